@@ -27,12 +27,72 @@
 __version__ = 1.1
 
 import cairo
+import heapq
 import math
 import random
 
 HORZ = 0
 VERT = 1
 
+# thinnest row, in pixels, a level of detail gantt chart draws; past that
+# rows are folded together (see gantt_size and GanttChart.calc_fold)
+MIN_ROW_HEIGHT = 4
+
+def task_span(item):
+    "(start, end) of a gantt row: one (start, end) piece or a list of them"
+    if hasattr(item, "__delitem__"):
+        return min([piece[0] for piece in item]), max([piece[1] for piece in item])
+    return item[0], item[1]
+
+def pack_lanes(spans):
+    """
+    Greedy interval colouring: give each (start, end) span a lane so that
+    spans sharing a lane do not overlap.  Spans are taken in start order and
+    go into the lane that came free first, if it is free by then; a heap
+    of (free from, lane) keeps that O(n log n), and the lane count is the
+    most spans ever open at once.  Returns (lane of each span, lane count).
+    """
+    lanes = [0] * len(spans)
+    free = []
+    count = 0
+    for number in sorted(range(len(spans)), key = lambda n: spans[n]):
+        start, end = spans[number]
+        if free and free[0][0] <= start:
+            lane = free[0][1]
+            heapq.heapreplace(free, (end, lane))
+        else:
+            lane = count
+            count += 1
+            heapq.heappush(free, (end, lane))
+        lanes[number] = lane
+    return lanes, count
+
+def gantt_size(rows, width = 1360, budget = 16000, row_height = 70, min_row_height = MIN_ROW_HEIGHT):
+    """
+    (width, height) of a gantt chart of rows rows that stays within a height
+    budget: each row, and the header, gets row_height pixels while that
+    fits, and an even share of the budget once it does not, down to
+    min_row_height.  Past that the height stays at the budget, and a
+    level of detail GanttChart folds several rows into each one it draws.
+    """
+    row = min(row_height, max(min_row_height, budget // (rows + 1)))
+    return width, min((rows + 1) * row, max(budget, 2 * min_row_height))
+
+def coalesce(spans, gap = 1.0):
+    """
+    Merge (x0, x1) pixel spans that lie less than gap apart into single
+    [x0, x1] segments, in x order.  However many pieces go in, no more
+    segments come out than there are gaps of a pixel across the image.
+    """
+    segments = []
+    for x0, x1 in sorted(spans):
+        if segments and x0 - segments[-1][1] < gap:
+            if x1 > segments[-1][1]:
+                segments[-1][1] = x1
+        else:
+            segments.append([x0, x1])
+    return segments
+
 def other_direction(direction):
     "explicit is better than implicit"
     if direction == HORZ:
@@ -71,6 +131,8 @@ class Plot(object):
         self.line_width = 0.5
         self.label_color = (0.0, 0.0, 0.0)
         self.grid_color = (0.8, 0.8, 0.8)
+
+        self.patterns = {}
         
     
     def create_surface(self, surface, width=None, height=None):
@@ -156,6 +218,23 @@ class Plot(object):
             else:
                 raise TypeError ("Background should be either cairo.LinearGradient or a 3-tuple, not %s" % type(background))
         
+    def pattern(self, key, make, x = 0, y = 0):
+        """
+        The pattern make() builds, made once per key and shared from then
+        on.  make() draws it with its origin at (0, 0); x and y translate
+        it to where it is wanted through the pattern matrix, so one
+        gradient serves every row or bar of the same size and colours.
+        The matrix is read when the pattern is filled with, so set the
+        source and fill before asking for the same key again.  This saves
+        building cairo pattern objects only: cairo's SVG surface still
+        writes a gradient definition each time one is filled with.
+        """
+        pattern = self.patterns.get(key)
+        if pattern is None:
+            pattern = self.patterns[key] = make()
+        pattern.set_matrix(cairo.Matrix(1, 0, 0, 1, -x, -y))
+        return pattern
+
     def render_background(self):
         if isinstance (self.background, cairo.LinearGradient):
             self.context.set_source(self.background)
@@ -817,9 +896,24 @@ class GanttChart (Plot) :
                  height = 480,
                  h_labels = None,
                  v_labels = None,
-                 colors = None):
+                 colors = None,
+                 packed = False,
+                 lod = False,
+                 style = 'gradient'):
         self.bounds = {}
         self.max_value = {}
+        # packed: rows share lanes and carry their label on the bar
+        self.packed = packed
+        # lod: pieces closer than a pixel are merged, bars too small
+        # for the rounded, shadowed look are drawn plain and rows too
+        # thin to see are folded together
+        self.lod = lod
+        # style: 'gradient' for the rounded, shadowed bars, 'flat' for one
+        # solid rectangle per bar, sharing a pattern per color
+        self.style = style
+        self.lanes = None
+        # rows (or lanes) drawn as one, see calc_fold
+        self.fold = 1
         Plot.__init__(self, surface, data, width, height,  h_labels = h_labels, v_labels = v_labels, series_colors = colors)
 
     def load_series(self, data, h_labels=None, v_labels=None, series_colors=None):
@@ -845,19 +939,63 @@ class GanttChart (Plot) :
             self.max_value[direction] = self.context.text_extents( str(self.bounds[direction][1] + 1) )[2]
 
     def calc_horz_extents(self):
+        if self.packed:
+            self.max_value[HORZ] = 0
+            self.borders[HORZ] = 20
+            return
         self.calc_extents(HORZ)
         self.borders[HORZ] = 100 + self.max_value[HORZ]
 
+    def calc_lanes(self):
+        # a label that does not fit on its bar goes after it, so the lane
+        # has to stay clear for that long too
+        self.context.set_font_size(0.009 * self.width)
+        step = float(self.width - self.borders[HORZ])/(len(self.labels[VERT]))
+        spans = []
+        for number, item in enumerate(self.data):
+            start, end = task_span(item)
+            label = self.bar_label(number)
+            width = self.context.text_extents(label)[2] + 8
+            if width > (end - start)*step:
+                end += width/step
+            spans.append((start, end))
+        self.lanes, lanes = pack_lanes(spans)
+        self.bounds[HORZ] = (0, lanes)
+
+    def bar_label(self, number):
+        if self.labels[HORZ] and number < len(self.labels[HORZ]) and self.labels[HORZ][number] != None:
+            return self.labels[HORZ][number]
+        return str(number + 1)
+
+    def row_of(self, number):
+        if self.packed:
+            return self.lanes[number] // self.fold
+        return number // self.fold
+
+    def calc_fold(self):
+        # with lod, rows that would be thinner than MIN_ROW_HEIGHT are
+        # folded together, fold consecutive rows (or lanes) to each one
+        # drawn, so the image keeps the height it was given
+        rows = self.bounds[HORZ][1]
+        fits = max(1, self.height // MIN_ROW_HEIGHT - 1)
+        if rows > fits:
+            self.fold = -(-rows // fits)
+            self.bounds[HORZ] = (0, -(-rows // self.fold))
+
     def calc_vert_extents(self):
         self.calc_extents(VERT)
         self.borders[VERT] = self.height/(self.bounds[HORZ][1] + 1)
 
     def calc_steps(self):
-        self.horizontal_step = (self.width - self.borders[HORZ])/(len(self.labels[VERT]))
+        self.horizontal_step = float(self.width - self.borders[HORZ])/(len(self.labels[VERT]))
         self.vertical_step = self.borders[VERT]
 
     def render(self):
         self.calc_horz_extents()
+        if self.packed:
+            self.calc_lanes()
+        if self.lod:
+            self.calc_fold()
         self.calc_vert_extents()
         self.calc_steps()
         self.render_background()
@@ -871,12 +1009,14 @@ class GanttChart (Plot) :
         cr.set_source_rgb(255,255,255)
         cr.rectangle(0,0,self.width, self.height)
         cr.fill()
-        for number,item in enumerate(self.data):
-            linear = cairo.LinearGradient(self.width/2, self.borders[VERT] + number*self.vertical_step, 
-                                          self.width/2, self.borders[VERT] + (number+1)*self.vertical_step)
+        step = self.vertical_step
+        def make():
+            linear = cairo.LinearGradient(0, 0, 0, step)
             linear.add_color_stop_rgb(0,1.0,1.0,1.0)
             linear.add_color_stop_rgb(1.0,0.9,0.9,0.9)
-            cr.set_source(linear)
+            return linear
+        for number in range(self.bounds[HORZ][1]):
+            cr.set_source(self.pattern(('row', step), make, 0, self.borders[VERT] + number*step))
             cr.rectangle(0,self.borders[VERT] + number*self.vertical_step,self.width,self.vertical_step)
             cr.fill()
 
@@ -895,11 +1035,16 @@ class GanttChart (Plot) :
         self.context.set_font_size(0.009 * self.width)
         ### Changed by Jason from 0.02 to handle my very large names.  0.01 is good, but some overlap.
 
-        self.render_horz_labels()
+        # a folded row stands for several, so it has no one name to show
+        if not self.packed and self.fold == 1:
+            self.render_horz_labels()
         self.render_vert_labels()
 
     def render_horz_labels(self):
         cr = self.context
+        if self.lod:
+            # rows can be squeezed below the font size
+            cr.set_font_size(min(0.009 * self.width, 0.8 * self.vertical_step))
         labels = self.labels[HORZ]
         if not labels:
             labels = [str(i) for i in range(1, self.bounds[HORZ][1] + 1)  ]
@@ -930,10 +1075,12 @@ class GanttChart (Plot) :
         self.context.fill()
     
     def draw_circular_shadow(self, x, y, radius, ang_start, ang_end, mult, shadow):
-        gradient = cairo.RadialGradient(x, y, 0, x, y, 2*radius)
-        gradient.add_color_stop_rgba(0, 0, 0, 0, shadow)
-        gradient.add_color_stop_rgba(1, 0, 0, 0, 0)
-        self.context.set_source(gradient)
+        def make():
+            gradient = cairo.RadialGradient(0, 0, 0, 0, 0, 2*radius)
+            gradient.add_color_stop_rgba(0, 0, 0, 0, shadow)
+            gradient.add_color_stop_rgba(1, 0, 0, 0, 0)
+            return gradient
+        self.context.set_source(self.pattern(('corner', radius, shadow), make, x, y))
         self.context.move_to(x,y)
         self.context.line_to(x + mult[0]*radius,y + mult[1]*radius)
         self.context.arc(x, y, 8, ang_start, ang_end)
@@ -943,11 +1090,14 @@ class GanttChart (Plot) :
 
     def draw_rectangle(self, x0, y0, x1, y1, color):
         cr = self.context
-        middle = (x0+x1)/2
-        linear = cairo.LinearGradient(middle,y0,middle,y1)
-        linear.add_color_stop_rgb(0,3.5*color[0]/5.0, 3.5*color[1]/5.0, 3.5*color[2]/5.0)
-        linear.add_color_stop_rgb(1,color[0],color[1],color[2])
-        cr.set_source(linear)
+        def make():
+            linear = cairo.LinearGradient(0,0,0,y1-y0)
+            linear.add_color_stop_rgb(0,3.5*color[0]/5.0, 3.5*color[1]/5.0, 3.5*color[2]/5.0)
+            linear.add_color_stop_rgb(1,color[0],color[1],color[2])
+            return linear
+        # y1-y0 comes out of row*vertical_step, so bars of one height can
+        # differ in the last bits; round it so they still share a gradient
+        cr.set_source(self.pattern(('bar', tuple(color[:3]), round(y1-y0, 3)), make, 0, y0))
 
         cr.arc(x0+5, y0+5, 5, 0, 2*math.pi)
         cr.arc(x1-5, y0+5, 5, 0, 2*math.pi)
@@ -959,48 +1109,131 @@ class GanttChart (Plot) :
 
     def draw_shadow(self, x0, y0, x1, y1):
         shadow = 0.4
-        h_mid = (x0+x1)/2
-        v_mid = (y0+y1)/2
-        h_linear_1 = cairo.LinearGradient(h_mid,y0-4,h_mid,y0+4)
-        h_linear_2 = cairo.LinearGradient(h_mid,y1-4,h_mid,y1+4)
-        v_linear_1 = cairo.LinearGradient(x0-4,v_mid,x0+4,v_mid)
-        v_linear_2 = cairo.LinearGradient(x1-4,v_mid,x1+4,v_mid)
-
-        h_linear_1.add_color_stop_rgba( 0, 0, 0, 0, 0)
-        h_linear_1.add_color_stop_rgba( 1, 0, 0, 0, shadow)
-        h_linear_2.add_color_stop_rgba( 0, 0, 0, 0, shadow)
-        h_linear_2.add_color_stop_rgba( 1, 0, 0, 0, 0)
-        v_linear_1.add_color_stop_rgba( 0, 0, 0, 0, 0)
-        v_linear_1.add_color_stop_rgba( 1, 0, 0, 0, shadow)
-        v_linear_2.add_color_stop_rgba( 0, 0, 0, 0, shadow)
-        v_linear_2.add_color_stop_rgba( 1, 0, 0, 0, 0)
-
-        self.draw_rectangular_shadow(h_linear_1,x0+4,y0-4,x1-x0-8,8)
-        self.draw_rectangular_shadow(h_linear_2,x0+4,y1-4,x1-x0-8,8)
-        self.draw_rectangular_shadow(v_linear_1,x0-4,y0+4,8,y1-y0-8)
-        self.draw_rectangular_shadow(v_linear_2,x1-4,y0+4,8,y1-y0-8)
+        # the edge fades are the same 8 pixel ramps for every bar, built
+        # at the origin and moved into place
+        def ramp(x1, y1, start, end):
+            def make():
+                linear = cairo.LinearGradient(0, 0, x1, y1)
+                linear.add_color_stop_rgba( 0, 0, 0, 0, start)
+                linear.add_color_stop_rgba( 1, 0, 0, 0, end)
+                return linear
+            return make
+
+        self.draw_rectangular_shadow(self.pattern(('top', shadow), ramp(0, 8, 0, shadow), 0, y0-4),
+                                     x0+4,y0-4,x1-x0-8,8)
+        self.draw_rectangular_shadow(self.pattern(('bottom', shadow), ramp(0, 8, shadow, 0), 0, y1-4),
+                                     x0+4,y1-4,x1-x0-8,8)
+        self.draw_rectangular_shadow(self.pattern(('left', shadow), ramp(8, 0, 0, shadow), x0-4, 0),
+                                     x0-4,y0+4,8,y1-y0-8)
+        self.draw_rectangular_shadow(self.pattern(('right', shadow), ramp(8, 0, shadow, 0), x1-4, 0),
+                                     x1-4,y0+4,8,y1-y0-8)
 
         self.draw_circular_shadow(x0+4, y0+4, 4, math.pi, 3*math.pi/2, (-1,0), shadow)
         self.draw_circular_shadow(x1-4, y0+4, 4, 3*math.pi/2, 2*math.pi, (0,-1), shadow)
         self.draw_circular_shadow(x0+4, y1-4, 4, math.pi/2, math.pi, (0,1), shadow)
         self.draw_circular_shadow(x1-4, y1-4, 4, 0, math.pi/2, (1,0), shadow)
 
+    def solid(self, color):
+        """
+        The solid pattern of a color, made once and shared by every bar
+        of that color.
+        """
+        color = tuple(color[:3])
+        return self.pattern(('solid', color), lambda: cairo.SolidPattern(*color))
+
+    def render_detail(self, row, spaces, color):
+        """
+        One row of plain bars where the rounded, shadowed look is not
+        wanted.  With lod the pieces are coalesced, segments under a pixel
+        wide become 1 pixel ticks, ones too small for rounded corners
+        plain rectangles, and only the rest get the full rounded, shadowed
+        bar.  In the flat style every bar is plain.  The plain ones of a
+        row are filled together.
+        """
+        y0 = self.borders[VERT] + row*self.vertical_step + self.vertical_step/4.0
+        y1 = self.borders[VERT] + row*self.vertical_step + 3.0*self.vertical_step/4.0
+        spans = [(self.borders[HORZ] + space[0]*self.horizontal_step,
+                  self.borders[HORZ] + space[1]*self.horizontal_step) for space in spaces]
+        flat = self.style == 'flat'
+        if self.lod:
+            spans = coalesce(spans)
+        plain = []
+        for x0, x1 in spans:
+            if self.lod and x1 - x0 < 1:
+                plain.append((x0, 1))
+            elif flat or x1 - x0 < 10 or y1 - y0 < 10:
+                plain.append((x0, x1 - x0))
+            else:
+                self.render_rectangle(x0, y0, x1, y1, color)
+        if plain:
+            cr = self.context
+            cr.set_source(self.solid(color))
+            for x0, w in plain:
+                cr.rectangle(x0, y0, w, y1 - y0)
+            cr.fill()
+
+    def render_folded(self):
+        # the spaces of all the lines folded into a row are coalesced
+        # together, drawn in the color of the first of them
+        rows = {}
+        for number,item in enumerate(self.data):
+            if not hasattr(item, "__delitem__"):
+                item = [item]
+            row = self.row_of(number)
+            if row in rows:
+                rows[row][0].extend(item)
+            else:
+                rows[row] = (list(item), self.series_colors[number])
+        for row, (spaces, color) in rows.iteritems():
+            self.render_detail(row, spaces, color)
+
     def render_plot(self):
+        if self.fold > 1:
+            self.render_folded()
+            return
         for number,item in enumerate(self.data):
-            if hasattr(item, "__delitem__") :
+            row = self.row_of(number)
+            if self.lod or self.style == 'flat':
+                if not hasattr(item, "__delitem__"):
+                    item = [item]
+                self.render_detail(row, item, self.series_colors[number])
+            elif hasattr(item, "__delitem__") :
                 for space in item:
                     self.render_rectangle(self.borders[HORZ] + space[0]*self.horizontal_step, 
-                                          self.borders[VERT] + number*self.vertical_step + self.vertical_step/4.0,
+                                          self.borders[VERT] + row*self.vertical_step + self.vertical_step/4.0,
                                           self.borders[HORZ] + space[1]*self.horizontal_step, 
-                                          self.borders[VERT] + number*self.vertical_step + 3.0*self.vertical_step/4.0, 
+                                          self.borders[VERT] + row*self.vertical_step + 3.0*self.vertical_step/4.0, 
                                           self.series_colors[number])
             else:
                 space = item
                 self.render_rectangle(self.borders[HORZ] + space[0]*self.horizontal_step, 
-                                      self.borders[VERT] + number*self.vertical_step + self.vertical_step/4.0,
+                                      self.borders[VERT] + row*self.vertical_step + self.vertical_step/4.0,
                                       self.borders[HORZ] + space[1]*self.horizontal_step, 
-                                      self.borders[VERT] + number*self.vertical_step + 3.0*self.vertical_step/4.0, 
+                                      self.borders[VERT] + row*self.vertical_step + 3.0*self.vertical_step/4.0, 
                                       self.series_colors[number])
+        if self.packed:
+            self.render_bar_labels()
+
+    def render_bar_labels(self):
+        cr = self.context
+        cr.set_font_size(0.009 * self.width)
+        for number,item in enumerate(self.data):
+            start, end = task_span(item)
+            label = self.bar_label(number)
+            w,h = cr.text_extents(label)[2], cr.text_extents(label)[3]
+            x0 = self.borders[HORZ] + start*self.horizontal_step
+            x1 = self.borders[HORZ] + end*self.horizontal_step
+            y = self.borders[VERT] + self.row_of(number)*self.vertical_step + self.vertical_step/2 + h/2
+            if w + 8 <= x1 - x0:
+                # on the bar
+                cr.set_source_rgb(0.2, 0.2, 0.2)
+                cr.move_to(x0 + 4, y)
+            else:
+                # just after it
+                cr.set_source_rgb(0.5, 0.5, 0.5)
+                cr.move_to(x1 + 4, y)
+            cr.show_text(label)
+
 def dot_line_plot(name,
                   data,
                   width,
@@ -1156,7 +1389,7 @@ def donut_plot(name, data, width, height, background = None, gradient = False, s
     plot.render()
     plot.commit()
 
-def gantt_chart(name, pieces, width, height, h_labels, v_labels, colors):
+def gantt_chart(name, pieces, width, height, h_labels, v_labels, colors, packed = False, lod = False, style = 'gradient'):
 
     '''
         - Function to generate Gantt Diagrams.
@@ -1171,6 +1404,18 @@ def gantt_chart(name, pieces, width, height, h_labels, v_labels, colors):
         h_labels - A list of names for each of the vertical lines;
         v_labels - A list of names for each of the horizontal spaces;
         colors - List containing the colors expected for each of the horizontal spaces
+        packed - Whether lines that do not overlap in time should share a lane. Each bar then
+                 carries its own label, on it or just after it. pack_lanes() gives the lane count,
+                 for working out the height
+        lod - Level of detail: spaces of a line less than a pixel apart are drawn as one, spaces
+              under a pixel wide as ticks and ones too small for rounded corners as plain
+              rectangles. Keeps the drawing bounded by the image size rather than the number
+              of spaces; gantt_size() works out an image size for a pixel budget. Lines that
+              would be thinner than MIN_ROW_HEIGHT pixels are folded, several to a row, and
+              then go without their labels
+        style - 'gradient' (the default) draws each space as a rounded bar with a gradient and a
+                drop shadow; 'flat' draws it as one solid rectangle, with a single pattern shared
+                by all spaces of a color, for far smaller and faster to draw files
 
         - Example of use
 
@@ -1182,7 +1427,7 @@ def gantt_chart(name, pieces, width, height, h_labels, v_labels, colors):
         
     '''
 
-    plot = GanttChart(name, pieces, width, height, h_labels, v_labels, colors)
+    plot = GanttChart(name, pieces, width, height, h_labels, v_labels, colors, packed, lod, style)
     plot.render()
     plot.commit()
 
@@ -0,0 +1,336 @@
+#!/usr/bin/python
+#
+# benchmark.py
+#
+# Times bpdbreport.py on dumps made by gendump.py and compares the times
+# with a stored baseline.
+#
+# For each size (10k, 100k and 1M jobs by default) a dump is generated
+# once into the work directory and kept for later runs.  Each case is run
+# a few times as its own bpdbreport.py process with --profile-json, and
+# the best time of each measurement is kept:
+#
+#   parse     every job in every state, nothing written (--show_all -q)
+#   filter    one day of backups out of the week (--show_backups -s/-e)
+#   output    every done job and try written out with -v
+#
+# Measurements are the run's wall time and the CPU time of the read,
+# prefilter, process_line, format and output stages, and the peak
+# resident set size of the run (peak_rss_kb; with --jobs also that of
+# the biggest worker, peak_rss_children_kb).  Anything that is slower
+# than the baseline by more than the tolerance (and by more than a
+# twentieth of a second, to keep noise out), or has grown by more than
+# the tolerance, is flagged, and the exit status is 1.  --save makes the
+# times of this run the baseline.
+#
+# --charts also draws the filter case's rows with produce_gantt.py in
+# each bar style, and measures the wall time and the size of the SVG:
+#
+#   chart_gradient    rounded bars with gradients and drop shadows
+#   chart_flat        one solid rectangle per bar (--flat)
+#
+# The charts need pycairo; without it --charts stops before any run.
+#
+# -j runs the parse case again with --jobs for each worker count given,
+# as parse_j1, parse_j2, ..., to see how the parallel parser scales on
+# the machine at hand.
+#
+# Usage:
+#
+#   benchmark.py [-n 10000,100000,1000000] [-r repeats] [-t percent]
+#                [-b baselines.json] [-w workdir] [-j workers,...]
+#                [--charts] [--save]
+
+import os
+import sys
+import json
+import time
+import getopt
+import tempfile
+import subprocess
+
+import gendump
+
+#############################################################################
+
+here = os.path.dirname(os.path.abspath(__file__))
+bpdbreport = os.path.join(here, 'bpdbreport.py')
+produce_gantt = os.path.join(here, 'produce_gantt.py')
+sample_fmt = os.path.join(here, 'sample.fmt')
+
+default_sizes = ( 10000, 100000, 1000000 )
+default_baselines = os.path.join(here, 'benchmarks.json')
+default_workdir = os.path.join(tempfile.gettempdir(), 'bpdbreport-bench')
+
+# gendump's default dump covers the week from 01/Oct/2012, the filter
+# case asks for one day of it
+cases = ( ( 'parse', [ '--stream', '--show_all', '-q' ] ),
+          ( 'filter', [ '--stream', '--show_backups', '-s', '03/Oct/2012',
+                        '-e', '03/Oct/2012', '-f', sample_fmt ] ),
+          ( 'output', [ '--stream', '-v', '-f', sample_fmt ] ) )
+
+stages = ( 'read', 'prefilter', 'process_line', 'format', 'output' )
+
+# chart case, and the produce_gantt.py switches it draws with
+chart_styles = ( ( 'chart_gradient', [] ), ( 'chart_flat', [ '--flat' ] ) )
+
+def worker_cases( counts ):
+    ''' The parse case with --jobs, once per worker count.'''
+    return tuple([ ( 'parse_j%d' % count,
+                     [ '--stream', '--jobs', str(count), '--show_all', '-q' ] )
+                   for count in counts ])
+
+# differences smaller than this are noise, whatever the tolerance says
+noise = 0.05
+
+#############################################################################
+
+def usage():
+    print >>sys.stderr, '''\nbenchmark.py usage:
+
+    benchmark.py [switches]
+
+    -n jobs,jobs...          dump sizes to run (default 10000,100000,1000000)
+    -r repeats               runs of each case, the best is kept (default 3)
+    -t percent               slowdown over the baseline that is flagged
+                               (default 20)
+    -b baselines.json        baseline file (default benchmarks.json next
+                               to this script)
+    -w workdir               where the generated dumps are kept
+                               (default %s)
+    -j workers,workers...    also run the parse case with --jobs at each
+                               of these worker counts
+    --charts                 also time produce_gantt.py in each bar style
+                               and measure the SVG size
+    --save                   store this run's times as the baseline
+    -h                       print this help and exit
+''' % default_workdir
+
+#############################################################################
+
+def dump_path( workdir, jobs ):
+    ''' The generated dump of that many jobs, made the first time it is asked for.'''
+    path = os.path.join(workdir, 'bpdbjobs.%d.out' % jobs)
+    if not os.path.exists(path):
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        print >>sys.stderr, 'generating', path
+        fp = open(path + '.tmp', 'wb')
+        gendump.Generator(jobs=jobs, layout='mix').write(fp)
+        fp.close()
+        os.rename(path + '.tmp', path)
+    return path
+
+def run_case( args, dump, profile_path ):
+    ''' Run bpdbreport.py once and return {measurement : seconds}, with
+    the peak RSS in kilobytes.'''
+    devnull = open(os.devnull, 'w')
+    try:
+        status = subprocess.call([ sys.executable, bpdbreport, '--profile-json', profile_path ] +
+                                 args + [ dump ], stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+    if status:
+        raise RuntimeError('bpdbreport.py %s exited with %d' % (' '.join(args), status))
+    profile = json.load(open(profile_path))
+    times = { 'wall' : profile['wall'] }
+    for stage in stages:
+        if stage in profile['stages']:
+            times[stage + '_cpu'] = profile['stages'][stage]['cpu']
+    times['peak_rss_kb'] = profile['peak_rss_kb']
+    if profile['peak_rss_children_kb']:
+        times['peak_rss_children_kb'] = profile['peak_rss_children_kb']
+    return times
+
+def run_chart( args, rows_path, workdir ):
+    ''' Run produce_gantt.py once on rows_path and return
+    {'wall' : seconds, 'svg_bytes' : size of the SVG}.'''
+    devnull = open(os.devnull, 'w')
+    began = time.time()
+    try:
+        # produce_gantt.py writes visual_schedule.svg where it is run
+        status = subprocess.call([ sys.executable, produce_gantt ] + args + [ rows_path ],
+                                 stdout=devnull, stderr=devnull, cwd=workdir)
+    finally:
+        devnull.close()
+    wall = time.time() - began
+    if status:
+        raise RuntimeError('produce_gantt.py %s exited with %d' % (' '.join(args), status))
+    svg = os.path.join(workdir, 'visual_schedule.svg')
+    if not os.path.exists(svg):
+        raise RuntimeError('produce_gantt.py %s wrote no SVG' % ' '.join(args))
+    size = os.path.getsize(svg)
+    os.remove(svg)
+    return { 'wall' : wall, 'svg_bytes' : size }
+
+def chart_rows( dump, workdir ):
+    ''' The filter case's rows, written once as produce_gantt.py input.'''
+    path = dump + '.rows'
+    if not os.path.exists(path):
+        fp = open(path + '.tmp', 'wb')
+        try:
+            status = subprocess.call([ sys.executable, bpdbreport, '--no_header' ] +
+                                     dict(cases)['filter'] + [ dump ], stdout=fp)
+        finally:
+            fp.close()
+        if status:
+            raise RuntimeError('bpdbreport.py exited with %d' % status)
+        os.rename(path + '.tmp', path)
+    return path
+
+def best_of( repeats, run ):
+    ''' Lowest value of each measurement over repeats calls of run().'''
+    best = {}
+    for repeat in range(repeats):
+        for measurement, value in run().iteritems():
+            if measurement not in best or value < best[measurement]:
+                best[measurement] = value
+    return best
+
+def run_size( workdir, jobs, repeats, charts=False, workers=() ):
+    ''' {case : {measurement : best seconds}} for one dump size.'''
+    dump = dump_path(workdir, jobs)
+    profile_path = os.path.join(workdir, 'profile.json')
+    results = {}
+    for name, args in cases + worker_cases(workers):
+        results[name] = best_of(repeats, lambda: run_case(args, dump, profile_path))
+    os.remove(profile_path)
+    if charts:
+        rows_path = chart_rows(dump, workdir)
+        for name, args in chart_styles:
+            results[name] = best_of(repeats, lambda: run_chart(args, rows_path, workdir))
+    return results
+
+def regressions( results, baseline, tolerance ):
+    ''' (case, measurement, seconds, baseline seconds) for everything that
+    got slower than the tolerance allows.'''
+    slower = []
+    for name in sorted(results):
+        for measurement in sorted(results[name]):
+            before = baseline.get(name, {}).get(measurement)
+            if before is None:
+                continue
+            seconds = results[name][measurement]
+            if measurement == 'svg_bytes':
+                # any growth of the output is worth a look
+                if seconds > before:
+                    slower.append(( name, measurement, seconds, before ))
+                continue
+            if measurement.endswith('_kb'):
+                if seconds > before * (1 + tolerance):
+                    slower.append(( name, measurement, seconds, before ))
+                continue
+            if seconds > before * (1 + tolerance) and seconds - before > noise:
+                slower.append(( name, measurement, seconds, before ))
+    return slower
+
+def load_baselines( path ):
+    try:
+        return json.load(open(path))
+    except (IOError, ValueError):
+        return {}
+
+def save_baselines( path, baselines ):
+    fp = open(path + '.tmp', 'w')
+    json.dump(baselines, fp, indent=1, sort_keys=True)
+    fp.write('\n')
+    fp.close()
+    os.rename(path + '.tmp', path)
+
+def report( jobs, results, baseline, workers=() ):
+    print 'jobs %d' % jobs
+    for name, args in cases + worker_cases(workers) + chart_styles:
+        if name not in results:
+            continue
+        for measurement in sorted(results[name]):
+            seconds = results[name][measurement]
+            before = baseline.get(name, {}).get(measurement)
+            if measurement == 'svg_bytes':
+                line = '    %-14s %-16s %10d bytes' % (name, measurement, seconds)
+                if before:
+                    line += '  (baseline %d, %+.1f%%)' % (before, (seconds - before) * 100.0 / before)
+                print line
+                continue
+            if measurement.endswith('_kb'):
+                line = '    %-14s %-16s %10d kB' % (name, measurement, seconds)
+                if before:
+                    line += '  (baseline %d, %+.1f%%)' % (before, (seconds - before) * 100.0 / before)
+                print line
+                continue
+            if before:
+                change = '%+6.1f%%' % ((seconds - before) / before * 100)
+                print '    %-14s %-16s %8.3fs  (baseline %.3fs, %s)' % (name, measurement, seconds, before, change)
+            else:
+                print '    %-14s %-16s %8.3fs' % (name, measurement, seconds)
+
+#############################################################################
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:r:t:b:w:j:h", ["save", "charts"])
+    except getopt.GetoptError, msg:
+        print "Usage Error:", repr(msg)
+        usage()
+        sys.exit(2)
+
+    sizes = default_sizes
+    repeats = 3
+    tolerance = 0.2
+    baselines_path = default_baselines
+    workdir = default_workdir
+    save = False
+    charts = False
+    workers = ()
+    try:
+        for o, a in opts:
+            if o == "-h":
+                usage()
+                sys.exit()
+            if o == "-n":
+                sizes = [ int(size) for size in a.split(',') ]
+            if o == "-r":
+                repeats = max(1, int(a))
+            if o == "-t":
+                tolerance = float(a) / 100
+            if o == "-b":
+                baselines_path = a
+            if o == "-w":
+                workdir = a
+            if o == "-j":
+                workers = [ max(1, int(count)) for count in a.split(',') ]
+            if o == "--save":
+                save = True
+            if o == "--charts":
+                charts = True
+    except ValueError:
+        print >>sys.stderr, '\n-n, -r, -t and -j need numbers'
+        usage()
+        sys.exit(1)
+
+    if charts:
+        try:
+            import cairo
+        except ImportError:
+            print >>sys.stderr, '--charts needs pycairo to draw the charts with'
+            sys.exit(1)
+
+    baselines = load_baselines(baselines_path)
+    flagged = []
+    for jobs in sizes:
+        results = run_size(workdir, jobs, repeats, charts, workers)
+        baseline = baselines.get(str(jobs), {})
+        report(jobs, results, baseline, workers)
+        for name, measurement, seconds, before in regressions(results, baseline, tolerance):
+            flagged.append('REGRESSION: %d jobs %s %s: %.3f, baseline %.3f'
+                           % (jobs, name, measurement, seconds, before))
+        if save:
+            baselines[str(jobs)] = results
+    if save:
+        save_baselines(baselines_path, baselines)
+        print >>sys.stderr, 'baseline saved to', baselines_path
+    for line in flagged:
+        print line
+    if flagged and not save:
+        sys.exit(1)
+
+# modeline vim:set ts=4 sw=4 et:
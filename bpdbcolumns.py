@@ -0,0 +1,185 @@
+#!/usr/bin/python
+#
+# bpdbcolumns.py
+#
+# Binary hand-off of the chart rows from bpdbreport.py --columns to
+# produce_gantt.py, instead of csv text that has to be split and int()ed
+# again on the other side.
+#
+# The rows are the ones sample.fmt gives (client, class, sched,
+# trystarted, tryended), one per try, stored by column.  client, class
+# and sched are dictionary encoded: each distinct name once, and a
+# 32 bit code per row.  trystarted and tryended are 64 bit ints.
+# Everything is little-endian:
+#
+#   'BPDBCOL1'                      magic
+#   uint64 rows
+#   three times (client, class, sched):
+#       uint32 names, uint32 bytes  the dictionary, names joined by '\0'
+#       names joined by '\0'
+#       uint32 code * rows
+#   int64 trystarted * rows
+#   int64 tryended * rows
+#
+# Readers memory-map the file and take each column as one array.
+#
+# Usage:
+#
+#   bpdbcolumns.py file.cols
+#
+# prints the rows back as csv, as bpdbreport.py -f sample.fmt would have.
+
+import os
+import sys
+import mmap
+import array
+import shutil
+import struct
+import tempfile
+import itertools
+
+#############################################################################
+
+magic = 'BPDBCOL1'
+name_columns = ( 'client', 'class', 'sched' )
+
+def int64_array( values=() ):
+    ''' An array of 64 bit ints.  Python 2 has no 'q' typecode, so this is
+    whichever of 'l' or 'i' is 8 bytes wide here.'''
+    for typecode in ( 'l', 'i' ):
+        if array.array(typecode).itemsize == 8:
+            return array.array(typecode, values)
+    raise ValueError('no 64 bit array type on this platform')
+
+def little_endian( values ):
+    ''' values as little-endian bytes.'''
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def from_bytes( values, data ):
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def code_array():
+    return array.array('I')
+
+#############################################################################
+
+def write_columns( path, rows ):
+    ''' Write rows of (client, class, sched, trystarted, tryended) to path.
+    Returns the number of rows written.'''
+    dictionaries = [ {} for column in name_columns ]
+    codes = [ code_array() for column in name_columns ]
+    starts = int64_array()
+    ends = int64_array()
+    for row in rows:
+        for idx in range(len(name_columns)):
+            names = dictionaries[idx]
+            code = names.get(row[idx])
+            if code is None:
+                code = names[row[idx]] = len(names)
+            codes[idx].append(code)
+        starts.append(row[3])
+        ends.append(row[4])
+    fp = open(path + '.tmp', 'wb')
+    fp.write(magic)
+    fp.write(struct.pack('<Q', len(starts)))
+    for names, column_codes in zip(dictionaries, codes):
+        ordered = [ None ] * len(names)
+        for name, code in names.iteritems():
+            ordered[code] = name
+        blob = '\0'.join(ordered)
+        fp.write(struct.pack('<II', len(ordered), len(blob)))
+        fp.write(blob)
+        fp.write(little_endian(column_codes))
+    fp.write(little_endian(starts))
+    fp.write(little_endian(ends))
+    fp.close()
+    # renamed into place so produce_gantt.py never maps half a file
+    os.rename(path + '.tmp', path)
+    return len(starts)
+
+class Columns(object):
+    ''' A --columns file, read through a memory map.  names[i] is the
+    dictionary of name column i, codes[i] its per-row codes; starts and
+    ends are the try times.'''
+    def __init__(self, fp):
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if m[:len(magic)] != magic:
+                raise ValueError('not a bpdbreport.py --columns file')
+            pos = len(magic)
+            self.rows = struct.unpack('<Q', m[pos:pos+8])[0]
+            pos += 8
+            self.names = []
+            self.codes = []
+            for column in name_columns:
+                count, size = struct.unpack('<II', m[pos:pos+8])
+                pos += 8
+                if count:
+                    self.names.append(m[pos:pos+size].split('\0'))
+                else:
+                    self.names.append([])
+                pos += size
+                width = code_array().itemsize * self.rows
+                self.codes.append(from_bytes(code_array(), m[pos:pos+width]))
+                pos += width
+            width = 8 * self.rows
+            self.starts = from_bytes(int64_array(), m[pos:pos+width])
+            self.ends = from_bytes(int64_array(), m[pos+width:pos+2*width])
+        finally:
+            m.close()
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        ''' The rows, as tuples of (client, class, sched, trystarted, tryended).'''
+        clients, classes, scheds = self.names
+        for client, klass, sched, start, end in itertools.izip(self.codes[0], self.codes[1],
+                                                               self.codes[2], self.starts, self.ends):
+            yield ( clients[client], classes[klass], scheds[sched], start, end )
+
+def seekable( fp ):
+    ''' fp, or if it can not seek back (stdin, a pipe) a temporary file
+    holding the rest of it, so that is_columns can look at the head and
+    Columns can map it.'''
+    try:
+        fp.seek(fp.tell())
+        return fp
+    except IOError:
+        pass
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(fp, spool, 1048576)
+    spool.seek(0)
+    return spool
+
+def is_columns( fp ):
+    ''' Whether the open file fp is a --columns file.  Leaves fp where it
+    was.  fp has to be seekable (see seekable()); on one that is not the
+    answer is always no.'''
+    try:
+        where = fp.tell()
+        head = fp.read(len(magic))
+        fp.seek(where)
+    except IOError:
+        return False
+    return head == magic
+
+#############################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print >>sys.stderr, 'usage: bpdbcolumns.py file.cols'
+        sys.exit(1)
+    out = []
+    for row in Columns(open(sys.argv[1], 'rb')):
+        out.append(','.join([ str(value) for value in row ]))
+    out.append('')
+    sys.stdout.write('\n'.join(out))
+
+# modeline vim:set ts=4 sw=4 et:
@@ -7,6 +7,66 @@
 #
 # Changelog:
 #
+# 2026-10-18:   JAP
+#   Added --stream.  Reads the input in large blocks and glues records
+#      that bpdbjobs split with an escaped newline back together instead
+#      of throwing them out as ERROR lines.  It reads no faster than the
+#      line reader: the csv split is most of the reading time either way.
+#   Added --stats.  Reports lines/sec and records/sec on stderr.
+#   process_line now returns a JobRecord with a list of TryRecords
+#      instead of nested dicts.  Both use __slots__, the repeated
+#      names (client, class, sched, ...) are interned and the numeric
+#      fields are kept as ints.  Item access (d['start'], d['try1'])
+#      still gives the old strings, and --shelve_dicts still writes
+#      plain dicts.
+#   Records that can't make it into the output (outside -s/-e/--hoursago,
+#      not a backup with --show_backups, or a state that won't be shown)
+#      are now dropped by looking at the leading fields of the raw line,
+#      before the csv split and process_line.  Turned off with -d.
+#   Added --jobs N.  Cuts each input file into N byte ranges on record
+#      boundaries and parses them in N worker processes.  The results
+#      are merged in file order so first-seen still wins.
+#   Added --store path.db.  Upserts jobs and tries into an indexed
+#      SQLite store (bpdbstore.py) instead of one big pickle, so other
+#      scripts can ask for one client or one night without loading
+#      everything.
+#   Added --state_file path.  Keeps the highest Done jobid reported,
+#      the last state of the jobs below it that are still in flux, and
+#      a size/checksum of the input.  Reruns skip Done jobs that were
+#      already reported and jobs whose state has not changed.
+#   Added --mmap.  Same as --stream, but regular files are memory-mapped
+#      and the prefilter only looks at the head of each record, so
+#      dropped records are never copied.  Several --jobs workers or
+#      runs over the same dump share the page cache.
+#   output_data now compiles the column format once into an OutputPlan
+#      (attrgetters plus per-column converters) and writes rows in
+#      large joined blocks instead of one print per row.  The job part
+#      of a row is only built once for all of its tries.
+#   -v converts each distinct start/end/elapsed value once (memoized
+#      per epoch second) instead of per cell.
+#   Added --rewrite rules.sed: the cleanup.sh substitutions applied
+#      to client/class/sched as rows are written (see rewrite.py).
+#   Added --merge for several master servers' dumps: jobs keyed on
+#      (master_server, jobid), duplicates dropped, and written in start
+#      order once every dump has been read.
+#   Added --segments dir: a job store partitioned by start day, loaded
+#      by appending deltas (see bpdbsegments.py).
+#   Added --group-by/--agg: running totals per group, folded in while
+#      parsing instead of keeping every job.
+#   Added --follow seconds (and --follow_cmd): re-reads the dump every
+#      so often and prints only the jobs that are new or changed.  One
+#      jobid table with Done > Active > Re-Queued > Queued, and records
+#      printed the same way as last poll are never re-parsed; Active
+#      and Done by default, Done jobs dropped after the window.
+#   Records are only split into filelist and status line lists if
+#      a column that is written asks for them; otherwise process_line
+#      steps over those blocks by their counts.
+#   Added --columns path: the chart rows (client, class, sched,
+#      trystarted, tryended) as a binary file with dictionary encoded
+#      names, for produce_gantt.py (see bpdbcolumns.py).
+#   Added --profile-json path: wall/CPU seconds per stage (read,
+#      prefilter, process_line, format, output, ...), the line, record,
+#      filtered, error, row and byte counts, and peak RSS, as JSON.
 # 2012-04-02:   JAP
 #   Added/verified default compatability with NetBackup 7.1.x.
 #      (technically 'frozenimage' became 'snapshot', but it's
@@ -101,10 +161,24 @@ import sys
 import time
 import types
 import getopt
+import operator
 import string
+import json
+import mmap
+import resource
+import contextlib
 import cPickle
 import fileinput
+import hashlib
+import tempfile
 import traceback
+import subprocess
+import multiprocessing
+
+import bpdbstore
+import bpdbsegments
+import bpdbcolumns
+import rewrite
 
 #############################################################################
 
@@ -144,12 +218,73 @@ def usage():
     --ymd                    change verbose date output format to yyyy/mm/dd
     --shelve_dicts filename  output dictonary to a python pickle object
                                This option implies -q
+    --store path.db          upsert all jobs and tries into a SQLite job store
+                               (see bpdbstore.py). This option implies -q
+    --segments dir           append all jobs and tries to a store with one
+                               segment per day (see bpdbsegments.py).
+                               This option implies -q
+    --columns path           write client, class, sched, trystarted and tryended
+                               of every try shown as a binary column file
+                               for produce_gantt.py (see bpdbcolumns.py).
+                               This option implies -q
+    --state_file path        incremental mode. Remembers the highest Done
+                               jobid reported so far and the state of the
+                               jobs below it that are not Done yet, then skips
+                               what is unchanged on the next run. If the
+                               input is the same as last time, nothing
+                               is parsed at all.
     --show_active            show Done and Active jobs
                                (may show duplicates if multiple files are used)
     --show_all               show All jobs
                                (may show duplicates if multiple files are used)
     --show_backups           shows only backup jobs
+    --jobs N                 parse with N worker processes. Each input file
+                               is cut into N pieces on record boundaries.
+                               Implies --stream. Ignored for stdin and -d.
+    --stats                  report lines/sec and records/sec to stderr
+    --profile-json path      write wall/CPU time per stage (read, prefilter,
+                               process_line, format, output, store), the
+                               lines, records, filtered records by reason,
+                               parse errors, rows, tries and bytes written
+                               and peak RSS to path as JSON
+    --stream                 read the input in large blocks and put records
+                               split by an escaped newline back together.
+    --mmap                   like --stream, but regular files are memory-mapped
+                               and scanned in place. Records dropped by the
+                               date/state filters are never copied. Works
+                               with --jobs; stdin is read as usual.
     --no_header              Omits the header line (useful for further scripting)
+    --merge                  each file is the dump of one master server. Jobs
+                               are keyed on (master_server, jobid), merged
+                               across the files in start order and given
+                               once each, in their most advanced state.
+                               Not with -a, --shelve_dicts, --store,
+                               --segments or --state_file; --jobs is
+                               ignored.
+    --group-by col,col...    print one row per group of these columns instead
+                               of one per job (or per try, if one of them
+                               is a try column). Jobs are folded into the
+                               totals as they are parsed and then dropped.
+                               Uses the -v, --rewrite and --show_* options;
+                               --jobs is ignored.
+    --agg op:col,op:col...   totals for --group-by. op is sum, min, max,
+                               mean or count (values present; count:try
+                               counts the tries).
+                               e.g. --group-by client,class,sched
+                                    --agg sum:kbytes,max:elapsed,count:trystarted
+    --follow seconds         keep running: re-read the input every so many
+                               seconds and print the rows of jobs that are
+                               new or changed since the last read. A job
+                               is held once, in its most advanced state.
+                               Shows Active and Done jobs (all with
+                               --show_all); a Done job is forgotten once
+                               it ended more than --hoursago hours (or a
+                               day) ago. -e defaults to no end. Stop with ^C.
+    --follow_cmd command     with --follow, run command (e.g. bpdbjobs
+                               -report -all_columns) for each read instead
+                               of reading files
+    --rewrite rules.sed      rewrite client, class and sched with the s///
+                               commands in rules.sed (see cleanup.sed)
     -q                       quiet (no output to stdout)
     --usage                  print detailed help message and exit
     -v                       verbose (human readable output)
@@ -258,72 +393,550 @@ def sec_to_hms( input ):
 
 #############################################################################
 
+class Prefilter(object):
+    '''Looks only at the leading fixed fields of a raw record (jobtype,
+    state, sched, start) and says whether the record could still make it
+    into the output.  Records that can't are dropped before they are
+    tokenized or run through process_line.  Anything it is not sure
+    about (escaped commas or quotes up front, odd values) is kept and
+    left to the normal checks.'''
+    all_states = ( '0', '1', '2', '3' )
+
+    def __init__(self, start_date, end_date, show_backups, states):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.show_backups = show_backups
+        self.states = states
+        self.dropped = { 'not_backup' : 0, 'state' : 0, 'window' : 0 }
+        # --state_file: what earlier runs already handled, and the
+        # state of every jobid seen in this run
+        self.hwm = -1
+        self.flux = {}
+        self.seen = None
+
+    def incremental(self, hwm, flux):
+        self.hwm = hwm
+        self.flux = flux
+        self.seen = {}
+        self.dropped['emitted'] = 0
+        self.dropped['unchanged'] = 0
+
+    def reset(self):
+        ''' Zero the counts and the seen states, for a --jobs worker
+        starting on its next chunk: it inherited them from the parent (or
+        its last chunk) and only reports its own.  Left in, older states
+        would be merged over newer ones.'''
+        for reason in self.dropped:
+            self.dropped[reason] = 0
+        if self.seen is not None:
+            self.seen = {}
+
+    def merge(self, dropped, seen):
+        ''' Fold in the counts from a --jobs worker.'''
+        for reason, count in dropped.iteritems():
+            self.dropped[reason] = self.dropped.get(reason, 0) + count
+        if self.seen is not None:
+            self.seen.update(seen)
+
+    def __call__(self, raw):
+        fields = raw.split(',', 9)
+        if len(fields) < 10:
+            return True
+        if self.seen is not None and fields[0].isdigit() and \
+           fields[2].isdigit() and '\\' not in fields[1]:
+            jobid = int(fields[0])
+            state = fields[2]
+            self.seen[jobid] = state
+            if jobid <= self.hwm:
+                if jobid not in self.flux:
+                    self.dropped['emitted'] += 1
+                    return False
+                if self.flux[jobid] == state:
+                    self.dropped['unchanged'] += 1
+                    return False
+        head = raw[:len(raw)-len(fields[9])]
+        if '\\' in head or '"' in head:
+            return True
+        if self.show_backups:
+            if fields[1] != '0' or fields[5] == '-':
+                self.dropped['not_backup'] += 1
+                return False
+        if fields[2] in self.all_states and fields[2] not in self.states:
+            self.dropped['state'] += 1
+            return False
+        if fields[8].isdigit():
+            start = int(fields[8])
+            if start < self.start_date or start > self.end_date:
+                self.dropped['window'] += 1
+                return False
+        return True
+
+#############################################################################
+
+class LineReader(object):
+    '''Original input path. One csv reader per line from fileinput, so a
+    record split by an escaped newline comes out as two broken records.'''
+    def __init__(self, files, prefilter=None):
+        self.files = files
+        self.prefilter = prefilter
+        self.lines = 0
+        self.records = 0
+        self.current = ''
+
+    def __iter__(self):
+        for inputline in fileinput.input(self.files):
+            self.lines += 1
+            self.current = inputline
+            if self.prefilter and not self.prefilter(inputline):
+                continue
+            try:
+                for line in csv.reader([inputline], escapechar='\\'):
+                    self.records += 1
+                    yield line
+            except csv.Error:
+                print >>sys.stderr, 'ERROR: ', inputline
+
+    def filename(self):
+        return fileinput.filename()
+
+    def lineno(self):
+        return fileinput.lineno()
+
+class _Feed(object):
+    '''Hands a csv reader exactly one record per next() call.  A record
+    that ends in a lone escape (the last line of a file, with no newline
+    after the backslash) makes the reader ask for more; it gets
+    StopIteration instead of the same record again, which ends the
+    record there.'''
+    line = None
+    def __iter__(self):
+        return self
+    def next(self):
+        line = self.line
+        if line is None:
+            raise StopIteration
+        self.line = None
+        return line
+
+class StreamReader(object):
+    '''Streaming input path for --stream. Reads each file in large blocks,
+    glues records that were split by an escaped newline back together
+    and runs a single csv reader over all of them.  This is for the glued
+    records, not for speed: splitting the fields takes as long as with a
+    reader per line.'''
+    def __init__(self, files, prefilter=None, blocksize=4194304):
+        self.files = files
+        self.prefilter = prefilter
+        self.blocksize = blocksize
+        self.lines = 0
+        self.records = 0
+        self.current = ''
+        self._filename = None
+        self._lineno = 0
+
+    def raw_records(self):
+        for filename in self.files:
+            # (filename, start, end) reads just that byte range, see --jobs
+            start = end = None
+            if type(filename) is types.TupleType:
+                filename, start, end = filename
+            self._filename = filename
+            self._lineno = 0
+            for raw in self.file_records(filename, start, end):
+                yield raw
+
+    def file_records(self, filename, start, end):
+        ''' Raw records of one file (or byte range of it) that get past the
+        prefilter.'''
+        remaining = -1
+        if filename == '-':
+            fp = sys.stdin
+        else:
+            fp = open(filename, 'rb')
+        if start is not None:
+            fp.seek(start)
+            remaining = end - start
+        prefilter = self.prefilter
+        pending = ''
+        tail = ''
+        while remaining:
+            if remaining > 0:
+                block = fp.read(min(self.blocksize, remaining))
+                remaining -= len(block)
+            else:
+                block = fp.read(self.blocksize)
+            if not block:
+                break
+            lines = (tail + block).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                self.lines += 1
+                self._lineno += 1
+                # an odd number of trailing backslashes escapes the newline
+                if line.endswith('\\') and (len(line) - len(line.rstrip('\\'))) % 2:
+                    pending += line + '\n'
+                    continue
+                self.current = pending + line + '\n'
+                pending = ''
+                if prefilter and not prefilter(self.current):
+                    continue
+                yield self.current
+        if tail or pending:
+            if tail:
+                self.lines += 1
+                self._lineno += 1
+            self.current = pending + tail
+            if not prefilter or prefilter(self.current):
+                yield self.current
+        if fp is not sys.stdin:
+            fp.close()
+
+    def __iter__(self):
+        feed = _Feed()
+        rows = csv.reader(feed, escapechar='\\')
+        for raw in self.raw_records():
+            try:
+                if '"' in raw:
+                    # keep an unbalanced quote from swallowing the records after it
+                    line = csv.reader([raw], escapechar='\\').next()
+                else:
+                    feed.line = raw
+                    line = rows.next()
+            except csv.Error:
+                print >>sys.stderr, 'ERROR: ', raw
+                continue
+            self.records += 1
+            yield line
+
+    def filename(self):
+        return self._filename
+
+    def lineno(self):
+        return self._lineno
+
+class MmapReader(StreamReader):
+    '''--mmap input path.  Regular files are memory-mapped and scanned for
+    record boundaries in place.  The prefilter only gets the first few
+    hundred bytes of each record, so records it drops are never copied
+    out of the page cache.  Stdin and other non-regular files go through
+    the block reader as usual.'''
+    head_size = 512
+
+    def file_records(self, filename, start, end):
+        if filename == '-' or not os.path.isfile(filename):
+            for raw in StreamReader.file_records(self, filename, start, end):
+                yield raw
+            return
+        fp = open(filename, 'rb')
+        size = os.fstat(fp.fileno()).st_size
+        if start is None:
+            start, end = 0, size
+        if start >= end:
+            fp.close()
+            return
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        fp.close()
+        find = m.find
+        prefilter = self.prefilter
+        head_size = self.head_size
+        pos = start
+        while pos < end:
+            nl = find('\n', pos, end)
+            while nl >= 0:
+                self.lines += 1
+                self._lineno += 1
+                # an odd number of trailing backslashes escapes the newline
+                slashes = 0
+                while nl - slashes > pos and m[nl-slashes-1] == '\\':
+                    slashes += 1
+                if slashes % 2 == 0:
+                    break
+                nl = find('\n', nl + 1, end)
+            if nl < 0:
+                if m[end-1] != '\n':
+                    self.lines += 1
+                    self._lineno += 1
+                stop = end
+            else:
+                stop = nl + 1
+            if prefilter:
+                head = m[pos:min(stop, pos + head_size)]
+                if stop - pos > head_size and head.count(',') < 9:
+                    head = m[pos:stop]
+                if not prefilter(head):
+                    pos = stop
+                    continue
+            self.current = m[pos:stop]
+            pos = stop
+            yield self.current
+        m.close()
+
+#############################################################################
+
+# bpdbjobs -report -all_columns field layout
+info_labels = ( 'jobid', 'jobtype', 'state', 'status', 'class', 'sched',
+                'client', 'server', 'start', 'elapsed', 'end', 'stunit',
+                'try', 'operation', 'kbytes', 'files', 'path_last_written',#17
+                'percent', 'jobpid', 'owner', 'subtype', 'classtype',
+                'schedtype', 'priority', 'group', 'master_server',
+                'retention_units', 'retention_period', 'compression',
+                'kbyteslastwritten', 'fileslastwritten', 'filelistcount' )
+try_labels1 = ( 'trypid', 'trystunit', 'tryserver', 'trystarted', 'tryelapsed',
+                'tryended', 'trystatus', 'trystatusdescription', 'trystatuscount' )
+try_labels2 = ( 'trybyteswritten','tryfileswritten' )
+info_labels4x = ( 'parentjob', 'kbpersec', 'copy', 'robot', 'vault', 'profile',
+                'session', 'ejecttapes', 'srcstunit', 'srcserver', 'srcmedia',
+                'dstmedia', 'stream' )
+info_labels5x = ( 'suspendable','resumable','restartable','datamovement',
+                'frozenimage','backupid','killable','controllinghost' )
+
+# fields that repeat across most jobs and are worth sharing one string for
+interned_labels = ( 'class', 'sched', 'client', 'server', 'stunit', 'owner',
+                'group', 'master_server', 'trystunit', 'tryserver',
+                'srcstunit', 'srcserver', 'controllinghost' )
+# fields that are stored as ints once they have been decoded
+int_labels = ( 'jobid', 'jobtype', 'state', 'status', 'start', 'elapsed', 'end',
+                'try', 'kbytes', 'files', 'percent', 'jobpid', 'subtype',
+                'classtype', 'schedtype', 'priority', 'retention_units',
+                'retention_period', 'compression', 'kbyteslastwritten',
+                'fileslastwritten', 'filelistcount', 'trycount',
+                'trypid', 'trystarted', 'tryelapsed', 'tryended', 'trystatus',
+                'trystatuscount', 'trybyteswritten', 'tryfileswritten',
+                'parentjob', 'kbpersec', 'copy', 'session', 'ejecttapes',
+                'stream', 'suspendable', 'resumable', 'restartable',
+                'datamovement', 'frozenimage', 'killable' )
+# int fields that are new for nearly every job, not worth a memo entry
+distinct_labels = ( 'jobid', 'start', 'elapsed', 'end', 'kbytes', 'files',
+                'jobpid', 'kbyteslastwritten', 'fileslastwritten', 'trypid',
+                'trystarted', 'tryelapsed', 'tryended', 'trybyteswritten',
+                'tryfileswritten', 'parentjob', 'kbpersec', 'session' )
+
+def decode_int( value ):
+    ''' Only canonical numbers are turned into ints so that str() gives
+    back exactly what bpdbjobs printed.'''
+    if value.isdigit() and (value[0] != '0' or len(value) == 1):
+        return int(value)
+    return value
+
+def decode_str( value ):
+    return value
+
+class IntMemo(dict):
+    ''' decode_int for every distinct string, looked up without a call into
+    Python for the ones seen before.  Most int fields take a handful of
+    values (state, status, percent, the try count) and there are a couple
+    of dozen of them per job.  Emptied when it fills up, like the
+    formatter memos.'''
+    def __missing__(self, value):
+        if len(self) >= memo_limit:
+            self.clear()
+        result = self[value] = decode_int(value)
+        return result
+
+decode_int_memo = IntMemo().__getitem__
+
+def decoders( labels ):
+    result = []
+    for label in labels:
+        if label in distinct_labels:
+            result.append((label, decode_int))
+        elif label in int_labels:
+            result.append((label, decode_int_memo))
+        elif label in interned_labels:
+            result.append((label, intern))
+        else:
+            result.append((label, decode_str))
+    return tuple(result)
+
+info_decoders = decoders(info_labels)
+try_decoders1 = decoders(try_labels1)
+try_decoders2 = decoders(try_labels2)
+info_decoders4x = decoders(info_labels4x)
+info_decoders5x = decoders(info_labels5x)
+
+#############################################################################
+
+def record_state( record ):
+    ''' Flat tuple of slot values (None for unset slots), which pickles a lot
+    faster than the default slot dict.  Used to ship records back from the
+    --jobs workers.'''
+    return tuple([ getattr(record, key, None) for key in record.__slots__ ])
+
+def set_record_state( record, state ):
+    # pickle's memo already hands back one string object per distinct name
+    # in each chunk, so there is no need to intern again here
+    for key, value in zip(record.__slots__, state):
+        if value is not None:
+            setattr(record, key, value)
+
+#############################################################################
+
+class TryRecord(object):
+    ''' One try of a job.  Attributes hold the decoded values, item access
+    gives the same strings the old per-try dict held.'''
+    __slots__ = try_labels1 + ( 'trystatuslines', ) + try_labels2
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+        if type(value) is int:
+            return str(value)
+        return value
+
+    def has_key(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def keys(self):
+        return [ key for key in self.__slots__ if hasattr(self, key) ]
+
+    def as_dict(self):
+        return dict([ (key, self[key]) for key in self.keys() ])
+
+    def __getstate__(self):
+        return record_state(self)
+
+    def __setstate__(self, state):
+        set_record_state(self, state)
+
+class JobRecord(object):
+    ''' One job from bpdbjobs.  Stands in for the dict process_line used
+    to build: attributes hold the decoded values, item access (including
+    'try1'..'tryN') gives the same strings the dict held.'''
+    __slots__ = info_labels + ( 'filelist', 'trycount' ) + info_labels4x + \
+                info_labels5x + ( 'tries', )
+
+    def __init__(self):
+        self.tries = []
+
+    def get_try(self, key):
+        if key.startswith('try') and key[3:].isdigit():
+            number = int(key[3:])
+            if 0 < number <= len(self.tries):
+                return self.tries[number-1]
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            return self.get_try(key)
+        except TypeError:
+            raise KeyError(key)
+        if type(value) is int:
+            return str(value)
+        return value
+
+    def has_key(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return key != 'tries'
+
+    def keys(self):
+        keys = [ key for key in self.__slots__[:-1] if hasattr(self, key) ]
+        for number in range(1, len(self.tries)+1):
+            keys.append('try'+str(number))
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def as_dict(self):
+        ''' The old process_line dict, for -a, -d and --shelve_dicts.'''
+        d = {}
+        for key in self.keys():
+            value = self[key]
+            if isinstance(value, TryRecord):
+                value = value.as_dict()
+            d[key] = value
+        return d
+
+    def __getstate__(self):
+        return record_state(self)
+
+    def __setstate__(self, state):
+        set_record_state(self, state)
+
+#############################################################################
+
+# The variable-length blocks of a record.  process_line only builds their
+# lists if these are set; the main program clears them when nothing it is
+# going to write asks for them (see projection()).
+keep_filelist = True
+keep_trystatuslines = True
+
+def projection( columns ):
+    ''' Set keep_filelist/keep_trystatuslines for a run that only writes
+    these columns.'''
+    global keep_filelist, keep_trystatuslines
+    keep_filelist = 'filelist' in columns
+    keep_trystatuslines = 'trystatuslines' in columns
+
 def process_line(buffer):
-    dict = {}
+    job = JobRecord()
     idx = 0
-    info_labels = ( 'jobid', 'jobtype', 'state', 'status', 'class', 'sched',
-                    'client', 'server', 'start', 'elapsed', 'end', 'stunit',
-                    'try', 'operation', 'kbytes', 'files', 'path_last_written',#17
-                    'percent', 'jobpid', 'owner', 'subtype', 'classtype',
-                    'schedtype', 'priority', 'group', 'master_server',
-                    'retention_units', 'retention_period', 'compression',
-                    'kbyteslastwritten', 'fileslastwritten', 'filelistcount' )
-    try_labels1 = ( 'trypid', 'trystunit', 'tryserver', 'trystarted', 'tryelapsed',
-                    'tryended', 'trystatus', 'trystatusdescription', 'trystatuscount' )
-    try_labels2 = ( 'trybyteswritten','tryfileswritten' )
-    info_labels4x = ( 'parentjob', 'kbpersec', 'copy', 'robot', 'vault', 'profile',
-                    'session', 'ejecttapes', 'srcstunit', 'srcserver', 'srcmedia',
-                    'dstmedia', 'stream' )
-    info_labels5x = ( 'suspendable','resumable','restartable','datamovement',
-                    'frozenimage','backupid','killable','controllinghost' )
-
-    for label in info_labels:
-        dict[label] = buffer[idx]
+
+    for label, decode in info_decoders:
+        setattr(job, label, decode(buffer[idx]))
         idx += 1
 
     try:
-        if dict['filelistcount'] > 0:
-            for f in range ( idx, idx+int(dict['filelistcount']) ):
-                try:
-                    dict['filelist'].append(buffer[idx])
-                except:
-                    dict['filelist'] = [buffer[idx]]
-                idx += 1
-        dict['trycount'] = buffer[idx]
+        filelistcount = int(job.filelistcount)
+        if filelistcount > 0 and not keep_filelist:
+            # nobody asked for it: step over it by its count
+            if idx + filelistcount > len(buffer):
+                raise IndexError('list index out of range')
+            idx += filelistcount
+        elif filelistcount > 0:
+            filelist = buffer[idx:idx+filelistcount]
+            if filelist:
+                job.filelist = filelist
+            idx += len(filelist)
+            if len(filelist) < filelistcount:
+                raise IndexError('list index out of range')
+        job.trycount = decode_int(buffer[idx])
         idx += 1
 
-        for job_try in range(1,int(dict['trycount'])+1):
-            try_idx = 'try'+str(job_try)
-            dict[try_idx] = {}
-            for trylabel in try_labels1:
-                dict[try_idx][trylabel] = buffer[idx]
+        for job_try in range(1,int(job.trycount)+1):
+            trydata = TryRecord()
+            job.tries.append(trydata)
+            for trylabel, decode in try_decoders1:
+                setattr(trydata, trylabel, decode(buffer[idx]))
                 idx += 1
-            if dict[try_idx]['trystatuscount'] > 0:
-                for f in range ( idx, idx+int(dict[try_idx]['trystatuscount']) ):
-                    try:
-                        dict[try_idx]['trystatuslines'].append(buffer[idx])
-                    except:
-                        dict[try_idx]['trystatuslines'] = [buffer[idx]]
-                    idx += 1
-            for trylabel in try_labels2:
-                dict[try_idx][trylabel] = buffer[idx]
+            trystatuscount = int(trydata.trystatuscount)
+            if trystatuscount > 0 and not keep_trystatuslines:
+                if idx + trystatuscount > len(buffer):
+                    raise IndexError('list index out of range')
+                idx += trystatuscount
+            elif trystatuscount > 0:
+                trystatuslines = buffer[idx:idx+trystatuscount]
+                if trystatuslines:
+                    trydata.trystatuslines = trystatuslines
+                idx += len(trystatuslines)
+                if len(trystatuslines) < trystatuscount:
+                    raise IndexError('list index out of range')
+            for trylabel, decode in try_decoders2:
+                setattr(trydata, trylabel, decode(buffer[idx]))
                 idx += 1
         try:
-            for label in info_labels4x:
-                dict[label] = buffer[idx]
+            for label, decode in info_decoders4x:
+                setattr(job, label, decode(buffer[idx]))
                 idx += 1
         except:
             pass
         try:
-            for label in info_labels5x:
-                dict[label] = buffer[idx]
+            for label, decode in info_decoders5x:
+                setattr(job, label, decode(buffer[idx]))
                 idx += 1
         except:
             pass
 
-        return dict, 0, False
+        return job, 0, False
     except:
-        return dict, sys.exc_info(),buffer
+        return job, sys.exc_info(),buffer
 
 #############################################################################
 
@@ -407,124 +1020,159 @@ def print_list(l,k,t):
             idx += 1
         print '\t'*(t-1)+'}'
 
-def output_data( d,col_fmt_input ):
-    try_labels1 = ( 'trypid', 'trystunit', 'tryserver', 'trystarted', 'tryelapsed',
-                    'tryended', 'trystatus', 'trystatusdescription', 'trystatuscount' )
-    try_labels2 = ( 'trybyteswritten','tryfileswritten' )
-    list4x = [ 'parentjob', 'kbpersec', 'copy', 'robot', 'vault', 'profile',
-            'session', 'ejecttapes', 'srcstunit', 'srcserver', 'srcmedia',
-            'dstmedia', 'stream' ]
-    list5x = [ 'suspendable','resumable','restartable','datamovement',
-            'frozenimage','backupid','killable','controllinghost' ]
+def default_columns( nbuVersion ):
+    col_fmt = list(info_labels)
+    if nbuVersion == '4x':
+        col_fmt.extend(info_labels4x)
+    elif nbuVersion == '5x':
+        col_fmt.extend(info_labels4x)
+        col_fmt.extend(info_labels5x)
+    return col_fmt
+
+def tuple_getter( columns ):
+    ''' attrgetter that always hands back a tuple, even for 0 or 1 columns.'''
+    if not columns:
+        return lambda record: ()
+    getter = operator.attrgetter(*columns)
+    if len(columns) == 1:
+        return lambda record: (getter(record),)
+    return getter
+
+# the label columns --rewrite applies to
+rewrite_columns = ( 'client', 'class', 'sched' )
+
+class OutputPlan(object):
+    ''' A column format worked out once: which columns come from the job and
+    which from each try, how to fetch them, and (with -v) how to convert
+    them.  output_data used to redo all of that for every cell.'''
+    def __init__(self, col_fmt):
+        # 'try' itself is a job column, every other try* column is per try
+        self.tries_matter = False
+        for h in col_fmt:
+            if h.startswith('try') and len(h) > 3:
+                self.tries_matter = True
+                break
+        self.job_columns = []
+        self.try_columns = []
+        self.layout = []
+        for column in col_fmt:
+            if column.startswith('try') and column != 'try':
+                self.layout.append((1, len(self.try_columns)))
+                self.try_columns.append(column)
+            else:
+                self.layout.append((0, len(self.job_columns)))
+                self.job_columns.append(column)
+        self.job_getter = tuple_getter(self.job_columns)
+        self.try_getter = tuple_getter(self.try_columns)
+        self.job_formatters = [ column_formatter(c) for c in self.job_columns ]
+        self.try_formatters = [ column_formatter(c) for c in self.try_columns ]
+        # --rewrite: job columns whose text goes through the rules
+        self.rewrites = []
+        if rewriter:
+            self.rewrites = [ idx for idx, c in enumerate(self.job_columns)
+                              if c in rewrite_columns ]
+
+    def job_values(self, record):
+        if verbose:
+            values = [ fmt(value) for fmt, value in zip(self.job_formatters, self.job_getter(record)) ]
+        else:
+            values = map(str, self.job_getter(record))
+        for idx in self.rewrites:
+            values[idx] = rewriter(values[idx])
+        return values
+
+    def try_values(self, record):
+        if verbose:
+            return [ fmt(value) for fmt, value in zip(self.try_formatters, self.try_getter(record)) ]
+        return map(str, self.try_getter(record))
 
+    def rows(self, job):
+        if not self.tries_matter:
+            # -v without any try columns has always printed empty lines
+            if verbose:
+                return [ '' ]
+            return [ ','.join(self.job_values(job)).rstrip(',') ]
+        parts = ( self.job_values(job), None )
+        rows = []
+        for number in try_order(len(job.tries)):
+            parts = ( parts[0], self.try_values(job.tries[number]) )
+            rows.append(','.join([ parts[src][idx] for src, idx in self.layout ]).rstrip(','))
+        return rows
+
+try_orders = {}
+def try_order( count ):
+    ''' Try indexes in the order the rows have always come out: sorted by
+    the 'try1', 'try10', 'try2' key names.'''
+    if count not in try_orders:
+        names = [ ('try'+str(n), n-1) for n in range(1, count+1) ]
+        names.sort()
+        try_orders[count] = [ idx for name, idx in names ]
+    return try_orders[count]
+
+def output_data( d,col_fmt_input ):
     keys = d.keys()
     keys.sort()
 
     if all_data:
         for key in keys:
             print key,'{'
-            k = d[key].keys()
+            record = d[key].as_dict()
+            k = record.keys()
             k.sort()
             for item in k:
-                if type(d[key][item]) is types.ListType:
-                    print_list(d[key][item],item,1)
-                elif type(d[key][item]) is types.DictType:
-                    print_dict(d[key][item],item,1)
+                if type(record[item]) is types.ListType:
+                    print_list(record[item],item,1)
+                elif type(record[item]) is types.DictType:
+                    print_dict(record[item],item,1)
                 else:
                     if verbose:
-                        print item,':',readability( item, d[key][item] )
+                        print item,':',readability( item, record[item] )
                     else:
-                        print item,':',d[key][item]
+                        print item,':',record[item]
             print '}*** END',key,'***\n'
         return
 
-    for key in keys:
-        col_fmt = col_fmt_input
-        nbuVersion = get_nbuVersion(d[key])
-
-        if not col_fmt:
-            col_fmt = [ 'jobid', 'jobtype', 'state', 'status', 'class', 'sched',
-                    'client', 'server', 'start', 'elapsed', 'end', 'stunit',
-                    'try', 'operation', 'kbytes', 'files', 'path_last_written',
-                    'percent', 'jobpid', 'owner', 'subtype', 'classtype',
-                    'schedtype', 'priority', 'group', 'master_server',
-                    'retention_units', 'retention_period', 'compression',
-                    'kbyteslastwritten', 'fileslastwritten', 'filelistcount' ]
-            if nbuVersion == '4x':
-                for item in list4x:
-                    col_fmt.append(item)
-            elif nbuVersion == '5x':
-                for item in list4x:
-                    col_fmt.append(item)
-                for item in list5x:
-                    col_fmt.append(item)
-
-        tries_matter = False
-        for h in col_fmt :
-            # must ignore the 'try' field...
-            if h.startswith('try') and len(h) > 3 :     
-                tries_matter = True
-                break
+    write_rows([ d[key] for key in keys ], col_fmt_input)
 
-        if tries_matter :
-            tryline = {}
-            try_re = re.compile("^try[0-9][0-9]*")
-            for thetry in d[key] :
-                if re.match(try_re, thetry) :
-                    tryline[thetry] = ''
-        else :
-            col_out = ''
-        for column in col_fmt:
-            if column.startswith('try') and column != 'try' :
-                try_column = True
-            else :
-                try_column = False
-
-            #print 'DEBUG', repr(sorted(d[key].keys()))
-            #print 'DEBUG', repr(verbose), repr(tries_matter), repr(try_column), column
-            if verbose and tries_matter and try_column :
-                for the_try in tryline.keys() :
-                    data = readability(column, d[key][the_try][column])
-                    tryline[the_try] += data+','
-            elif verbose and tries_matter and not try_column :
-                for the_try in tryline.keys() :
-                    data = readability(column, d[key][column])
-                    tryline[the_try] += data+','
-            elif verbose and not tries_matter and try_column :
-                data = readability(column, d[key][column])
-                col_out += data+','
-            #elif verbose and not tries_matter and not try_column : # case not valid. no tries_matter = no try_col
-            elif not verbose and tries_matter and try_column :
-                for the_try in tryline.keys() :
-                    tryline[the_try] += d[key][the_try][column] + ','
-            elif not verbose and tries_matter and not try_column :
-                for the_try in tryline.keys() :
-                    #print 'DEBUG', repr(d[key]['filelist'])
-                    tryline[the_try] += d[key][column] + ','
-            #elif not verbose and not tries_matter and try_column : # case not valid. no tries_matter = no try_col
-            elif not verbose and not tries_matter and not try_column :
-                col_out += d[key][column]+','
-
-#            if verbose and tries_matter :
-#                for the_try in tryline.keys() :
-#                    data = readability(column, d[key][the_try][column])
-#                    tryline[the_try] += data+','
-#            elif verbose and not tries_matter :
-#                data = readability(column, d[key][column])
-#                col_out += data+','
-#            elif not verbose and tries_matter :
-#                for the_try in tryline.keys() :
-#                    print 'DEBUG', repr(d[key][the_try]['POLICY'])
-#                    tryline[the_try] += d[key][the_try][column] + ','
-#            else :      # not verbose and not tries_matter
-#                col_out += d[key][column]+','
-        if tries_matter :
-            for the_try in sorted(tryline.keys()) :
-                col_out = tryline[the_try].rstrip(',')
-                print col_out
-        else :
-            col_out = col_out.rstrip(',')
-            print col_out
+def write_rows( jobs,col_fmt_input ):
+    ''' Write the rows for an iterable of jobs, in that order.'''
+    plans = {}
+    if col_fmt_input:
+        plan = OutputPlan(col_fmt_input)
+    out = []
+    for job in jobs:
+        if not col_fmt_input:
+            nbuVersion = get_nbuVersion(job)
+            plan = plans.get(nbuVersion)
+            if plan is None:
+                plan = plans[nbuVersion] = OutputPlan(default_columns(nbuVersion))
+        out.extend(plan.rows(job))
+        if len(out) >= 10000:
+            out.append('')
+            sys.stdout.write('\n'.join(out))
+            out = []
+    if out:
+        out.append('')
+        sys.stdout.write('\n'.join(out))
+
+# client, class and sched of a job, for --columns
+name_getter = operator.attrgetter('client', 'class', 'sched')
+
+def column_rows( jobs ):
+    ''' (client, class, sched, trystarted, tryended) for every try of jobs,
+    in the order write_rows gives them and with --rewrite applied, for
+    bpdbcolumns.write_columns.  Tries that lack either time are left out.'''
+    for job in jobs:
+        names = map(str, name_getter(job))
+        if rewriter:
+            names = map(rewriter, names)
+        names = tuple(names)
+        for idx in try_order(len(job.tries)):
+            job_try = job.tries[idx]
+            started = getattr(job_try, 'trystarted', None)
+            ended = getattr(job_try, 'tryended', None)
+            if type(started) is int and type(ended) is int:
+                yield names + ( started, ended )
 
 #############################################################################
 
@@ -562,33 +1210,260 @@ def print_header( col_fmt,d ):
 
 #############################################################################
 
-def readability( key, string ):
+agg_ops = ( 'sum', 'min', 'max', 'mean', 'count' )
+
+# columns -v shows as a time, so their mean is shown as one too
+timed_columns = ( 'start', 'end', 'trystarted', 'tryended', 'elapsed', 'tryelapsed' )
+
+def parse_group_by( spec ):
+    return [ column.strip() for column in spec.split(',') if column.strip() ]
+
+def parse_aggs( spec ):
+    ''' 'sum:kbytes,max:elapsed' -> [('sum', 'kbytes'), ('max', 'elapsed')]'''
+    aggs = []
+    for item in spec.split(','):
+        try:
+            op, column = item.strip().split(':')
+        except ValueError:
+            raise ValueError('--agg entries look like op:column, not %r' % item)
+        if op not in agg_ops:
+            raise ValueError('--agg op must be one of %s, not %r' % (', '.join(agg_ops), op))
+        aggs.append(( op, column ))
+    return aggs
+
+def is_try_column( column ):
+    return column.startswith('try') and column != 'try'
+
+class Aggregator(object):
+    ''' --group-by/--agg.  Each job filed under one of its state() stand-ins
+    for parse_input's state dicts is folded into the running totals of its
+    group and then dropped, so only the totals and the jobids are held.
+    As in the state dicts the first record of a jobid in a state wins, so
+    a job is counted once per state it is listed in, just as the csv
+    output lists it.
+
+    If a group-by column is a try column every try is a row, with the job
+    columns repeated, as in the csv output.  Otherwise every job is a row
+    and try columns in --agg take in all of its tries.  count:try counts
+    tries, not the jobs that have a try count.'''
+    def __init__(self, group_by, aggs):
+        self.group_by = group_by
+        self.aggs = aggs
+        self.per_try = False
+        for column in group_by:
+            if is_try_column(column):
+                self.per_try = True
+        self.groups = {}
+
+    def state(self):
+        return _AggregatorState(self)
+
+    def add(self, job):
+        if self.per_try:
+            for job_try in job.tries:
+                self.fold(job, job_try)
+        else:
+            self.fold(job, None)
+
+    def values(self, job, job_try, column):
+        if not is_try_column(column):
+            return [ getattr(job, column, '') ]
+        if job_try is not None:
+            return [ getattr(job_try, column, '') ]
+        return [ getattr(t, column, '') for t in job.tries ]
+
+    def fold(self, job, job_try):
+        key = tuple([ self.values(job, job_try, column)[0] for column in self.group_by ])
+        totals = self.groups.get(key)
+        if totals is None:
+            # per agg: [ sum, values summed, min, max, values present ]
+            totals = self.groups[key] = [ [ 0, 0, None, None, 0 ] for agg in self.aggs ]
+        for total, ( op, column ) in zip(totals, self.aggs):
+            if op == 'count' and column == 'try':
+                if job_try is None:
+                    total[4] += len(job.tries)
+                else:
+                    total[4] += 1
+                continue
+            for value in self.values(job, job_try, column):
+                if value == '' or value is None:
+                    continue
+                total[4] += 1
+                if type(value) is not int:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        continue
+                total[0] += value
+                total[1] += 1
+                if total[2] is None or value < total[2]:
+                    total[2] = value
+                if total[3] is None or value > total[3]:
+                    total[3] = value
+
+    def header(self):
+        return ','.join([ column.upper() for column in self.group_by ] +
+                        [ ( '%s_%s' % (op, column) ).upper() for op, column in self.aggs ])
+
+    def display_key(self, key):
+        values = []
+        for column, value in zip(self.group_by, key):
+            if verbose:
+                value = column_formatter(column)(value)
+            value = str(value)
+            if rewriter and column in rewrite_columns:
+                value = rewriter(value)
+            values.append(value)
+        return tuple(values)
+
+    def rows(self):
+        ''' One csv row per group, sorted by group.  Groups that --rewrite
+        or -v make look the same are added together.'''
+        groups = {}
+        for key, totals in self.groups.iteritems():
+            key = self.display_key(key)
+            if key not in groups:
+                groups[key] = [ list(total) for total in totals ]
+                continue
+            for into, total in zip(groups[key], totals):
+                into[0] += total[0]
+                into[1] += total[1]
+                into[4] += total[4]
+                if into[2] is None or (total[2] is not None and total[2] < into[2]):
+                    into[2] = total[2]
+                if into[3] is None or (total[3] is not None and total[3] > into[3]):
+                    into[3] = total[3]
+        keys = groups.keys()
+        keys.sort()
+        rows = []
+        for key in keys:
+            values = list(key)
+            for total, ( op, column ) in zip(groups[key], self.aggs):
+                values.append(self.agg_value(op, column, total))
+            rows.append(','.join(values))
+        return rows
+
+    def agg_value(self, op, column, total):
+        if op == 'count':
+            return str(total[4])
+        if not total[1]:
+            return ''
+        if op == 'sum':
+            value = total[0]
+        elif op == 'min':
+            value = total[2]
+        elif op == 'max':
+            value = total[3]
+        else:
+            value = float(total[0]) / total[1]
+            if not verbose or column not in timed_columns:
+                return '%.2f' % value
+            value = int(round(value))
+        if verbose:
+            value = column_formatter(column)(value)
+        return str(value)
+
+class _AggregatorState(object):
+    ''' One state dict's worth of an Aggregator: it keeps the jobids filed
+    in that state, as ints where they are numbers, and hands each new job
+    to the Aggregator.'''
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+        self.seen = set()
+
+    def key(self, jobid):
+        try:
+            return int(jobid)
+        except (TypeError, ValueError):
+            return jobid
+
+    def get(self, jobid):
+        return self.key(jobid) in self.seen
+
+    def __getitem__(self, jobid):
+        raise KeyError(jobid)
+
+    def __setitem__(self, jobid, job):
+        self.seen.add(self.key(jobid))
+        self.aggregator.add(job)
+
+#############################################################################
+
+formatters = {}
+def column_formatter( key ):
+    ''' The readability() conversion for one column, picked once.  The
+    function takes the raw value (str or the int JobRecord keeps) and
+    always gives back what readability() would have.'''
+    if key in formatters:
+        return formatters[key]
+    table = { 'jobtype' : job_type, 'state' : job_state,
+              'schedtype' : sched_type, 'subtype' : sub_type }.get(key)
+    if table:
+        def fmt( value ):
+            value = plain(value)
+            try:
+                return table[value]
+            except:
+                return value
+    elif key in ['start','end','trystarted','tryended']:
+        fmt = memoized(format_timestamp, timestamp_memo)
+    elif key in ['elapsed','tryelapsed']:
+        fmt = memoized(format_elapsed, elapsed_memo)
+    else:
+        fmt = plain
+    formatters[key] = fmt
+    return fmt
+
+# Timestamps and durations repeat a lot (a parent and its children, the
+# same second on many streams), so both are converted once per distinct
+# value.  The memos are shared by all columns of the kind and are simply
+# emptied when they fill up.
+memo_limit = 1 << 17
+timestamp_memo = {}
+elapsed_memo = {}
+
+def memoized( convert, memo ):
+    def fmt( value ):
+        try:
+            return memo[value]
+        except KeyError:
+            if len(memo) >= memo_limit:
+                memo.clear()
+            result = memo[value] = convert(value)
+            return result
+    return fmt
+
+def timestamp_pattern():
+    if mdy:
+        return '%m/%d/%Y %H:%M:%S'
+    elif ymd:
+        return '%Y/%m/%d %H:%M:%S'
+    return '%d/%b/%Y %H:%M:%S'
+
+def format_timestamp( value ):
     try:
-        if key == 'jobtype':
-            string = job_type[string]
-        elif key == 'state':
-            string = job_state[string]
-        elif key == 'schedtype':
-            string = sched_type[string]
-        elif key == 'subtype':
-            string = sub_type[string]
-        elif key in ['start','end','trystarted','tryended']:
-            if mdy:
-                string = time.strftime( '%m/%d/%Y %H:%M:%S', time.localtime(int(string)))
-            elif ymd:
-                string = time.strftime( '%Y/%m/%d %H:%M:%S', time.localtime(int(string)))
-            else:
-                string = time.strftime( '%d/%b/%Y %H:%M:%S', time.localtime(int(string)))
-        elif key in ['elapsed','tryelapsed']:
-            (h,m,s) = sec_to_hms(string)
-            string = '%d:%02d:%02d' % (h,m,s)
+        return time.strftime( timestamp_pattern(), time.localtime(int(value)))
     except:
-        pass
-    return string
+        return plain(value)
+
+def format_elapsed( value ):
+    try:
+        return '%d:%02d:%02d' % sec_to_hms(value)
+    except:
+        return plain(value)
+
+def plain( value ):
+    if type(value) is int:
+        return str(value)
+    return value
+
+def readability( key, string ):
+    return column_formatter(key)(string)
 
 #############################################################################
 
-def output_debug_dict( d ):
+def output_debug_dict( job ):
+    d = job.as_dict()
     keys = d.keys()
     keys.sort()
 
@@ -605,16 +1480,635 @@ def output_debug_dict( d ):
 
 #############################################################################
 
+def report_stats( lines, records, dropped, elapsed ):
+    if elapsed <= 0:
+        elapsed = 0.000001
+    print >>sys.stderr, 'STATS:    lines read:          ', lines
+    if dropped:
+        for reason in sorted(dropped.keys()):
+            print >>sys.stderr, 'STATS:    dropped (%s):%s' % (reason, ' '*(14-len(reason))), dropped[reason]
+    print >>sys.stderr, 'STATS:    records parsed:      ', records
+    print >>sys.stderr, 'STATS:    seconds:              %.3f' % elapsed
+    print >>sys.stderr, 'STATS:    lines/sec:            %d' % (lines / elapsed)
+    print >>sys.stderr, 'STATS:    records/sec:          %d' % (records / elapsed)
+
+#############################################################################
+
+class Profile(object):
+    ''' --profile-json.  Wall and CPU seconds plus an item count per stage,
+    and the counters that go with them, written out as JSON at the end of
+    the run.  The stages are timed by wrapping the functions that do the
+    work (see instrument()), so a run without --profile-json pays nothing.
+    Stages nest: read includes prefilter, output includes format.'''
+    def __init__(self):
+        self.started = time.time()
+        self.cpu_started = time.clock()
+        self.stages = {}
+        self.counts = { 'lines_read' : 0, 'records_parsed' : 0,
+                        'rows_written' : 0, 'tries_emitted' : 0 }
+
+    def stage(self, name):
+        totals = self.stages.get(name)
+        if totals is None:
+            # [ wall, cpu, items ]
+            totals = self.stages[name] = [ 0.0, 0.0, 0 ]
+        return totals
+
+    def add(self, name, wall, cpu, items=1):
+        totals = self.stage(name)
+        totals[0] += wall
+        totals[1] += cpu
+        totals[2] += items
+
+    def reset(self):
+        ''' Zero everything in place (the wrappers hold on to the totals).'''
+        for totals in self.stages.itervalues():
+            totals[:] = [ 0.0, 0.0, 0 ]
+        for name in self.counts:
+            self.counts[name] = 0
+
+    def merge(self, stages, counts):
+        ''' Fold in what a --jobs worker measured.'''
+        for name, ( wall, cpu, items ) in stages.iteritems():
+            self.add(name, wall, cpu, items)
+        for name, count in counts.iteritems():
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def wrap(self, name, func):
+        ''' func, timed under stage name, one item per call.'''
+        totals = self.stage(name)
+        clock = time.clock
+        now = time.time
+        def timed(*args):
+            wall = now()
+            cpu = clock()
+            try:
+                return func(*args)
+            finally:
+                totals[0] += now() - wall
+                totals[1] += clock() - cpu
+                totals[2] += 1
+        return timed
+
+    @contextlib.contextmanager
+    def timed(self, name, items=1):
+        wall = time.time()
+        cpu = time.clock()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - wall, time.clock() - cpu, items)
+
+    def report(self, filtered, parse_errors, jobs_kept, bytes_written):
+        ''' Everything measured, as a dict ready for json.dump.'''
+        counts = dict(self.counts)
+        counts['filtered'] = filtered
+        counts['parse_errors'] = parse_errors
+        counts['jobs_kept'] = jobs_kept
+        counts['bytes_written'] = bytes_written
+        return {
+            'started' : self.started,
+            'argv' : sys.argv[1:],
+            'wall' : time.time() - self.started,
+            'cpu' : time.clock() - self.cpu_started,
+            'cpu_children' : sum(os.times()[2:4]),
+            'stages' : dict([ ( name, { 'wall' : wall, 'cpu' : cpu, 'items' : items } )
+                              for name, ( wall, cpu, items ) in self.stages.iteritems()
+                              if items or wall ]),
+            'counts' : counts,
+            # ru_maxrss is in kilobytes on Linux; children are --jobs workers
+            'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children_kb' : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+
+class TimedReader(object):
+    ''' A reader whose records are timed under the read stage: reading,
+    gluing, the prefilter and the csv split all happen while the next
+    record is fetched.'''
+    def __init__(self, reader, profile):
+        self.reader = reader
+        self.totals = profile.stage('read')
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def __iter__(self):
+        records = iter(self.reader)
+        totals = self.totals
+        clock = time.clock
+        now = time.time
+        while True:
+            wall = now()
+            cpu = clock()
+            try:
+                line = records.next()
+            except StopIteration:
+                line = None
+            totals[0] += now() - wall
+            totals[1] += clock() - cpu
+            if line is None:
+                return
+            totals[2] += 1
+            yield line
+
+class CountingWriter(object):
+    ''' sys.stdout, counting the bytes written through it.'''
+    def __init__(self, fp):
+        self.fp = fp
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        self.fp.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+def instrument( profile ):
+    ''' Put the --profile-json timers around the functions of each stage.
+    Rebinds the module globals, so it has to run before any parsing.'''
+    global parse_input, process_line, write_rows
+    parse = parse_input
+    def profiled_parse( reader, masters, job_key=None ):
+        with profile.timed('parse'):
+            parse(TimedReader(reader, profile), masters, job_key)
+        profile.counts['lines_read'] += reader.lines
+        profile.counts['records_parsed'] += reader.records
+    parse_input = profiled_parse
+    process_line = profile.wrap('process_line', process_line)
+    Prefilter.__call__ = profile.wrap('prefilter', Prefilter.__call__)
+    OutputPlan.job_values = profile.wrap('format', OutputPlan.job_values)
+    OutputPlan.try_values = profile.wrap('format', OutputPlan.try_values)
+    plan_rows = OutputPlan.rows
+    def counted_rows( plan, job ):
+        rows = plan_rows(plan, job)
+        profile.counts['rows_written'] += len(rows)
+        if plan.tries_matter:
+            profile.counts['tries_emitted'] += len(rows)
+        return rows
+    OutputPlan.rows = counted_rows
+    write_rows = profile.wrap('output', write_rows)
+    Aggregator.rows = profile.wrap('output', Aggregator.rows)
+    bpdbstore.store_jobs = profile.wrap('store', bpdbstore.store_jobs)
+    bpdbsegments.append_jobs = profile.wrap('segments', bpdbsegments.append_jobs)
+
+def write_profile( path, profile, prefilter, masters, stdout ):
+    filtered = { 'parse' : dict([ ( reason, count ) for reason, count in parse_counts.iteritems()
+                                  if reason != 'parse_errors' ]) }
+    if prefilter:
+        filtered['prefilter'] = prefilter.dropped
+    jobs_kept = 0
+    for master in masters:
+        if type(master) is dict:
+            jobs_kept += len(master)
+    fp = open(path + '.tmp', 'w')
+    json.dump(profile.report(filtered, parse_counts['parse_errors'], jobs_kept,
+                             stdout.written), fp, indent=1, sort_keys=True)
+    fp.write('\n')
+    fp.close()
+    os.rename(path + '.tmp', path)
+
+#############################################################################
+
+# records parse_input let go, by reason (see --profile-json)
+parse_counts = { 'parse_errors' : 0, 'not_backup' : 0, 'window' : 0, 'duplicate' : 0 }
+
+def parse_input( reader, masters, job_key=None ):
+    ''' Run each record from reader through process_line and file it under
+    masters (queued, active, requeued, done) by state.  The first record
+    seen for a jobid wins.  job_key, if given, makes the dict key from
+    the record instead of the jobid alone.'''
+    queued_master, active_master, requeued_master, done_master = masters
+    for line in reader:
+        try:
+            if show_backups :
+                if line[1] != '0' or line[5] == '-' :
+                    # if it's NOT a type=backup ('0') or the schedule IS '-' (aka parent job for
+                    # DB's or Exchange), continue
+                    parse_counts['not_backup'] += 1
+                    continue
+            try:
+                d, exc, buf_debug = process_line(line)
+                if exc:
+                    raise
+            except:
+                parse_counts['parse_errors'] += 1
+                if debug_mode:
+                    print >>sys.stderr, 'DEBUG:  ', '*'*30
+                    print >>sys.stderr, 'DEBUG:   Filename:            ', reader.filename()
+                    print >>sys.stderr, 'DEBUG:   Line Number:         ', reader.lineno()
+                    print >>sys.stderr, 'DEBUG:   Exception:           ', exc[0]
+                    print >>sys.stderr, 'DEBUG:   Exception:           ', exc[1]
+                    print >>sys.stderr, 'DEBUG:   Dict Contents:       '
+                    output_debug_dict(d)
+                    print >>sys.stderr, 'DEBUG:   ', buf_debug
+                    print >>sys.stderr, 'DEBUG:   ', line
+                    print >>sys.stderr, 'DEBUG:  ', '*'*30
+                else:
+                    print >>sys.stderr, 'ERROR: ', line
+            else:
+                try:
+                    if int(d.start) >= start_date and int(d.start) <= end_date:
+                        # To make this cleaner, maybe cross check dicts based on
+                        # the assumption that Done jobs are the most important?
+                        state = int(d.state)
+                        if job_key:
+                            jobid = job_key(d)
+                        else:
+                            jobid = d['jobid']
+                        if state == 0:
+                            if not queued_master.get(jobid):
+                                try:
+                                    queued_master[jobid].append(d)
+                                except:
+                                    queued_master[jobid] = d
+                            else:
+                                parse_counts['duplicate'] += 1
+                        elif state == 1:
+                            if not active_master.get(jobid):
+                                try:
+                                    active_master[jobid].append(d)
+                                except:
+                                    active_master[jobid] = d
+                            else:
+                                parse_counts['duplicate'] += 1
+                        elif state == 2:
+                            if not requeued_master.get(jobid):
+                                try:
+                                    requeued_master[jobid].append(d)
+                                except:
+                                    requeued_master[jobid] = d
+                            else:
+                                parse_counts['duplicate'] += 1
+                        elif state == 3:
+                            if not done_master.get(jobid):
+                                try:
+                                    done_master[jobid].append(d)
+                                except:
+                                    done_master[jobid] = d
+                            else:
+                                parse_counts['duplicate'] += 1
+                    else:
+                        parse_counts['window'] += 1
+                except:
+                    parse_counts['parse_errors'] += 1
+                    if debug_mode:
+                        exc = sys.exc_info()
+                        print >>sys.stderr, 'DEBUG:  ', '*'*30
+                        print >>sys.stderr, 'DEBUG:   Filename:            ', reader.filename()
+                        print >>sys.stderr, 'DEBUG:   Line Number:         ', reader.lineno()
+                        print >>sys.stderr, 'DEBUG:   Exception:           ', exc[0]
+                        print >>sys.stderr, 'DEBUG:   Exception:           ', exc[1]
+                        print >>sys.stderr, 'DEBUG:   Dict Contents:       '
+                        output_debug_dict(d)
+                        print >>sys.stderr, 'DEBUG:   ', buf_debug
+                        print >>sys.stderr, 'DEBUG:   ', line
+                        print >>sys.stderr, 'DEBUG:  ', '*'*30
+                    else:
+                        print >>sys.stderr, 'ERROR: ', line
+        except:
+            print >>sys.stderr, 'ERROR: ', reader.current
+
+#############################################################################
+
+def record_boundary( fp, offset ):
+    ''' First offset at or after offset where a record starts, i.e. just past
+    a newline that is not escaped with a backslash.'''
+    if offset <= 0:
+        return 0
+    back = min(offset, 1024)
+    fp.seek(offset - back)
+    data = fp.read(back)
+    idx = back - 1
+    while True:
+        idx = data.find('\n', idx)
+        if idx < 0:
+            block = fp.read(65536)
+            if not block:
+                return offset - back + len(data)
+            idx = len(data)
+            data += block
+            continue
+        slashes = 0
+        while idx - slashes > 0 and data[idx-slashes-1] == '\\':
+            slashes += 1
+        if slashes % 2 == 0:
+            return offset - back + idx + 1
+        idx += 1
+
+def split_input( files, jobs ):
+    ''' Cut each file into at most jobs byte ranges that start and end on
+    record boundaries.'''
+    chunks = []
+    for filename in files:
+        size = os.path.getsize(filename)
+        count = max(1, min(jobs, size // 1048576))
+        fp = open(filename, 'rb')
+        edges = [ record_boundary(fp, size * i // count) for i in range(count) ] + [size]
+        fp.close()
+        for i in range(count):
+            if edges[i] < edges[i+1]:
+                chunks.append((filename, edges[i], edges[i+1]))
+    return chunks
+
+def parse_chunk( chunk ):
+    ''' Worker side of --jobs. Relies on the option globals and prefilter
+    being inherited through fork.  A worker can be handed several chunks,
+    and is handed the parent's counters, so they are zeroed for each one;
+    otherwise the parent adds them up more than once.'''
+    for reason in parse_counts:
+        parse_counts[reason] = 0
+    if prefilter:
+        prefilter.reset()
+    if profile:
+        profile.reset()
+    masters = ( {}, {}, {}, {} )
+    if mmap_mode:
+        reader = MmapReader([chunk], prefilter)
+    else:
+        reader = StreamReader([chunk], prefilter)
+    parse_input(reader, masters)
+    dropped = {}
+    seen = {}
+    if prefilter:
+        dropped = prefilter.dropped
+        seen = prefilter.seen or {}
+    measured = None
+    if profile:
+        measured = ( profile.stages, profile.counts )
+    return masters, reader.lines, reader.records, dropped, seen, dict(parse_counts), measured
+
+def parse_parallel( files, jobs, masters, prefilter ):
+    ''' Parse the chunks of files in a pool of jobs worker processes and
+    merge the results in file order, so the first record seen for a
+    jobid wins just like it does in the serial path.'''
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(parse_chunk, split_input(files, jobs), 1)
+    finally:
+        pool.close()
+    pool.join()
+    lines = records = 0
+    for chunk_masters, chunk_lines, chunk_records, chunk_dropped, chunk_seen, chunk_counts, chunk_measured in results:
+        for master, chunk_master in zip(masters, chunk_masters):
+            for jobid, job in chunk_master.iteritems():
+                if jobid not in master:
+                    master[jobid] = job
+        lines += chunk_lines
+        records += chunk_records
+        if prefilter:
+            prefilter.merge(chunk_dropped, chunk_seen)
+        for reason, count in chunk_counts.iteritems():
+            parse_counts[reason] += count
+        if chunk_measured:
+            profile.merge(*chunk_measured)
+    return lines, records
+
+def open_reader( files, prefilter ):
+    ''' The reader --mmap/--stream/default asks for.'''
+    if mmap_mode:
+        return MmapReader(files, prefilter)
+    elif stream_mode:
+        return StreamReader(files, prefilter)
+    return LineReader(files, prefilter)
+
+#############################################################################
+
+def merge_key( job, source ):
+    ''' (start, master_server, jobid) for --merge.  3.x records carry no
+    master server, so the file they came from stands in for it.'''
+    master = getattr(job, 'master_server', '') or source
+    return ( int(job.start), master, job['jobid'] )
+
+def merge_masters( files, prefilter, states ):
+    ''' The jobs in states of several master server dumps, in start order.
+    A job that turns up in more than one dump (overlapping dumps of the
+    same master) is given once, in its most advanced state; the earlier
+    dump wins a tie.  Jobs are keyed on (master_server, jobid), so jobids
+    shared by different masters do not collide.  bpdbjobs lists jobs
+    newest first, so no job can be written before every dump has been
+    read: all of them are held at once, as in a plain run over the same
+    files, and sorted by merge_key at the end.'''
+    rank = bpdbstore.state_rank.get
+    merged = {}
+    for source in files:
+        masters = ( {}, {}, {}, {} )
+        parse_input(open_reader([ source ], prefilter), masters,
+                    lambda d: merge_key(d, source)[1:])
+        for state in states:
+            for job in masters[state].itervalues():
+                key = merge_key(job, source)
+                held = merged.get(key)
+                if held is None or rank(job.state, -1) > rank(held.state, -1):
+                    merged[key] = job
+    for key in sorted(merged):
+        yield merged[key]
+
+#############################################################################
+
+def input_signature( files ):
+    ''' Size plus an md5 of the whole of each input file, read in blocks.
+    One more pass over the input, but any change to it, wherever it is
+    and whatever it does to the size, makes for a new signature.'''
+    signature = []
+    for filename in files:
+        if filename == '-':
+            return None
+        fp = open(filename, 'rb')
+        digest = hashlib.md5()
+        size = 0
+        while True:
+            block = fp.read(1048576)
+            if not block:
+                break
+            size += len(block)
+            digest.update(block)
+        fp.close()
+        signature.append([ size, digest.hexdigest() ])
+    return signature
+
+def load_state( path ):
+    ''' Read a --state_file.  A missing or unreadable file means start over.'''
+    state = { 'hwm' : -1, 'flux' : {}, 'inputs' : None }
+    try:
+        fp = open(path, 'r')
+        saved = json.load(fp)
+        fp.close()
+        state['hwm'] = int(saved['hwm'])
+        state['flux'] = dict([ (int(jobid), str(s)) for jobid, s in saved['flux'].iteritems() ])
+        state['inputs'] = saved['inputs']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return state
+
+def save_state( path, hwm, flux, inputs ):
+    fp = open(path + '.tmp', 'w')
+    json.dump({ 'hwm' : hwm,
+                'flux' : dict([ (str(jobid), s) for jobid, s in flux.iteritems() ]),
+                'inputs' : inputs }, fp)
+    fp.close()
+    os.rename(path + '.tmp', path)
+
+def next_state( hwm, seen, emitted ):
+    ''' The new high-water mark is the highest jobid emitted as Done.  Every
+    other jobid at or below it that was seen in this run and is not Done
+    yet stays in flux with its last state, so a rerun can tell whether it
+    changed.  A Done job there is finished, whether it was reported now,
+    on an earlier run or not at all, so it is left out and the state file
+    stays the size of the jobs still running.'''
+    for jobid in emitted:
+        if jobid > hwm:
+            hwm = jobid
+    flux = {}
+    for jobid, state in seen.iteritems():
+        if jobid <= hwm and state != '3' and jobid not in emitted:
+            flux[jobid] = state
+    return hwm, flux
+
+#############################################################################
+
+class Follower(object):
+    ''' --follow prefilter.  Remembers a hash of every raw record the last
+    poll read, so a record bpdbjobs has printed the same way again is
+    dropped before it is tokenized.  Only new or changed records get as far
+    as the wrapped Prefilter and process_line.'''
+    def __init__(self, prefilter):
+        self.prefilter = prefilter
+        self.last = set()
+        self.current = set()
+        self.unchanged = 0
+
+    def begin(self):
+        ''' Start a poll: what the previous one read is now the baseline.'''
+        self.last = self.current
+        self.current = set()
+        self.unchanged = 0
+
+    def __call__(self, raw):
+        key = hash(raw)
+        self.current.add(key)
+        if key in self.last:
+            self.unchanged += 1
+            return False
+        if self.prefilter:
+            return self.prefilter(raw)
+        return True
+
+class FollowTable(object):
+    ''' The one jobid table of --follow.  Stands in for all four of
+    parse_input's state dicts.  A record replaces the job it has on file if
+    it is in a more advanced state (Queued < Re-Queued < Active < Done), or
+    in the same state but printed differently; every job replaced or added
+    is kept as a change until take_changes().  A job that has been Done
+    for longer than window seconds is dropped by prune(): Done is final,
+    and its record, printed the same way on every poll, never gets past
+    the Follower again, so the table only holds the current window.'''
+    def __init__(self, window=86400):
+        self.jobs = {}
+        self.changed = {}
+        self.window = window
+
+    def get(self, jobid):
+        return None
+
+    def __getitem__(self, jobid):
+        raise KeyError(jobid)
+
+    def __setitem__(self, jobid, job):
+        current = self.jobs.get(jobid)
+        if current is not None and \
+           bpdbstore.state_rank.get(job.state, -1) < bpdbstore.state_rank.get(current.state, -1):
+            return
+        self.jobs[jobid] = job
+        self.changed[jobid] = job
+
+    def take_changes(self):
+        ''' The jobs changed since the last call, by jobid.'''
+        changed = self.changed
+        self.changed = {}
+        return changed
+
+    def prune(self, now):
+        ''' Forget the jobs that ended as Done more than window seconds
+        before now.  Returns how many were dropped.'''
+        oldest = now - self.window
+        old = []
+        for jobid, job in self.jobs.iteritems():
+            if job.state != 3:
+                continue
+            ended = getattr(job, 'end', None)
+            if type(ended) is not int:
+                ended = getattr(job, 'start', None)
+            if type(ended) is int and ended < oldest:
+                old.append(jobid)
+        for jobid in old:
+            del self.jobs[jobid]
+        return len(old)
+
+def run_command( command, path ):
+    ''' Run the --follow_cmd stand-in for bpdbjobs with its output in path.'''
+    fp = open(path, 'wb')
+    try:
+        return subprocess.call(command, shell=True, stdout=fp)
+    finally:
+        fp.close()
+
+def follow( files, command, interval, prefilter, states, col_fmt, window ):
+    ''' --follow: re-read files (or the output of command) every interval
+    seconds and write the rows of the jobs in states that are new or have
+    changed since the last poll.  Jobs Done for longer than window seconds
+    are forgotten.  Runs until ^C.'''
+    table = FollowTable(window)
+    follower = Follower(prefilter)
+    masters = ( table, table, table, table )
+    if command:
+        handle, output_path = tempfile.mkstemp(prefix='bpdbreport.')
+        os.close(handle)
+        files = [ output_path ]
+    try:
+        try:
+            while True:
+                poll_start = time.time()
+                status = 0
+                if command:
+                    status = run_command(command, output_path)
+                if status:
+                    print >>sys.stderr, 'WARNING: %r exited with %d, poll skipped' % (command, status)
+                else:
+                    follower.begin()
+                    reader = StreamReader(files, follower)
+                    parse_input(reader, masters)
+                    changed = table.take_changes()
+                    table.prune(poll_start)
+                    keys = [ jobid for jobid, job in changed.iteritems() if job.state in states ]
+                    keys.sort()
+                    if output:
+                        write_rows([ changed[key] for key in keys ], col_fmt)
+                        sys.stdout.flush()
+                    if show_stats:
+                        print >>sys.stderr, 'STATS:    poll: %d lines, %d unchanged, %d parsed, %d jobs changed, %d shown, %.3fs' % \
+                              (reader.lines, follower.unchanged, reader.records,
+                               len(changed), len(keys), time.time() - poll_start)
+                time.sleep(max(0, interval - (time.time() - poll_start)))
+        except KeyboardInterrupt:
+            # ^C is how --follow is stopped
+            pass
+    finally:
+        if command:
+            os.remove(output_path)
+
+#############################################################################
+
 if __name__ == '__main__':
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                    "f:s:e:hvxadq", ["hoursago=","shelve_dicts=", "show_active", "show_all", "show_backups", "no_header", "usage", "mdy", "ymd"])
+                                    "f:s:e:hvxadq", ["hoursago=","shelve_dicts=", "show_active", "show_all", "show_backups", "no_header", "usage", "mdy", "ymd", "stats", "stream", "jobs=", "store=", "state_file=", "mmap", "rewrite=", "merge", "segments=", "group-by=", "agg=", "follow=", "follow_cmd=", "profile-json=", "columns="])
     except getopt.GetoptError, msg:
         # print help information to stderr and exit:
         print "Usage Error:", repr(msg)
         usage()
         sys.exit(2)
-    if not args:
+    if not args and "--follow_cmd" not in [ o for o, a in opts ]:
         for o, a in opts:
             if o == "-h":
                 usage()
@@ -647,6 +2141,7 @@ if __name__ == '__main__':
     mdy             = False                         # --mdy
     ymd             = False                         # --ymd
     start_date      = 0                             # -s
+    hoursago        = ''                            # --hoursago
     show_active     = False                         # --show_active
     show_all        = False                         # --show_all
     show_backups    = False                         # --show_backups
@@ -656,6 +2151,23 @@ if __name__ == '__main__':
     col_fmt         = ''                            # parsed column output string
     shelve_dicts    = False                         # shelve data for future use
     output          = True                          # -q default output, option turns it off
+    show_stats      = False                         # --stats
+    stream_mode     = False                         # --stream
+    jobs            = 1                             # --jobs
+    mmap_mode       = False                         # --mmap
+    store_path      = ''                            # --store
+    segments_path   = ''                            # --segments
+    state_file      = ''                            # --state_file
+    rewriter        = None                          # --rewrite
+    merge_mode      = False                         # --merge
+    group_by        = []                            # --group-by
+    aggs            = []                            # --agg
+    follow_interval = 0                             # --follow
+    follow_cmd      = ''                            # --follow_cmd
+    end_given       = False                         # -e
+    profile_path    = ''                            # --profile-json
+    columns_path    = ''                            # --columns
+    profile         = None
 
     for o, a in opts:
         if o == "-h":
@@ -672,6 +2184,17 @@ if __name__ == '__main__':
             shelve_dicts = True
             output = False
             pkl = a
+        if o == "--state_file":
+            state_file = a
+        if o == "--store":
+            store_path = a
+            output = False
+        if o == "--segments":
+            segments_path = a
+            output = False
+        if o == "--columns":
+            columns_path = a
+            output = False
         if o == "-q":
             output = False
         if o == "-v":
@@ -689,6 +2212,21 @@ if __name__ == '__main__':
             mdy = True
         if o == "--ymd":
             ymd = True
+        if o == "--stats":
+            show_stats = True
+        if o == "--stream":
+            stream_mode = True
+        if o == "--mmap":
+            stream_mode = True
+            mmap_mode = True
+        if o == "--jobs":
+            stream_mode = True
+            try:
+                jobs = int(a)
+            except ValueError:
+                print >>sys.stderr, '\n--jobs needs a number of worker processes'
+                usage()
+                sys.exit(1)
         if o == "--hoursago":
             hoursago = a
             start_date = end_date - int(hoursago) * 3600
@@ -703,15 +2241,102 @@ if __name__ == '__main__':
             try:
                 end_date = time.mktime(time.strptime(a, '%d/%b/%Y'))
                 end_date += 86399   # Add 23:59:59 to enddate to include that day
+                end_given = True
             except:
                 print >>sys.stderr, '\nDate values must be in dd/mmm/yyyy format'
                 usage()
                 sys.exit(1)
+        if o == "--merge":
+            merge_mode = True
+        if o == "--follow":
+            try:
+                follow_interval = float(a)
+            except ValueError:
+                follow_interval = -1
+            if follow_interval <= 0:
+                print >>sys.stderr, '\n--follow needs a number of seconds between polls'
+                usage()
+                sys.exit(1)
+        if o == "--follow_cmd":
+            follow_cmd = a
+        if o == "--profile-json":
+            profile_path = a
+        if o == "--group-by":
+            group_by = parse_group_by(a)
+        if o == "--agg":
+            try:
+                aggs = parse_aggs(a)
+            except ValueError, msg:
+                print >>sys.stderr, '\n' + str(msg)
+                usage()
+                sys.exit(1)
+        if o == "--rewrite":
+            try:
+                rewriter = rewrite.load(a)
+            except (IOError, rewrite.RuleError), msg:
+                print >>sys.stderr, '\nCan not read rewrite rules:', msg
+                usage()
+                sys.exit(1)
         if o == "-a":
             all_data = True
         if o == "-x":
             xplicite = True
 
+    if debug_mode:
+        jobs = 1
+    if aggs and not group_by:
+        print >>sys.stderr, '\n--agg needs --group-by'
+        usage()
+        sys.exit(1)
+    if group_by and (merge_mode or all_data or shelve_dicts or store_path or segments_path or state_file):
+        print >>sys.stderr, '\n--group-by only works on its own (not with --merge, -a, --shelve_dicts, --store, --segments or --state_file)'
+        usage()
+        sys.exit(1)
+    if group_by:
+        jobs = 1
+    if columns_path and (merge_mode or group_by or all_data or follow_interval):
+        print >>sys.stderr, '\n--columns can not be used with --merge, --group-by, -a or --follow'
+        usage()
+        sys.exit(1)
+    if follow_cmd and not follow_interval:
+        print >>sys.stderr, '\n--follow_cmd needs --follow'
+        usage()
+        sys.exit(1)
+    if follow_interval and (merge_mode or group_by or all_data or shelve_dicts or store_path or segments_path or state_file or debug_mode):
+        print >>sys.stderr, '\n--follow only works with the csv output (not --merge, --group-by, -a, -d, --shelve_dicts, --store, --segments or --state_file)'
+        usage()
+        sys.exit(1)
+    if follow_interval and not follow_cmd and '-' in args:
+        print >>sys.stderr, '\n--follow re-reads its input, so it can not be stdin'
+        usage()
+        sys.exit(1)
+    if follow_interval and not end_given:
+        # jobs that start after this run began belong in the output too
+        end_date = sys.maxint
+    # how long --follow remembers a Done job: the --hoursago window, or a day
+    follow_window = 86400
+    if hoursago:
+        follow_window = int(hoursago) * 3600
+    if merge_mode and (all_data or shelve_dicts or store_path or segments_path or state_file):
+        print >>sys.stderr, '\n--merge only works with the csv output (not -a, --shelve_dicts, --store, --segments or --state_file)'
+        usage()
+        sys.exit(1)
+
+    if format_file:
+        col_fmt = get_output_cols(format_file)
+    # -a, -d, --shelve_dicts, --store and --segments hand on whole records,
+    # everything else only needs the filelist or status lines to write them
+    if not (all_data or debug_mode or shelve_dicts or store_path or segments_path):
+        projection(list(col_fmt or default_columns('5x')) + group_by +
+                   [ column for op, column in aggs ])
+        if columns_path:
+            projection(( 'client', 'class', 'sched', 'trystarted', 'tryended' ))
+
+    if profile_path:
+        profile = Profile()
+        instrument(profile)
+        sys.stdout = CountingWriter(sys.stdout)
+
     done_master = {}
     active_master = {}
     queued_master = {}
@@ -722,82 +2347,84 @@ if __name__ == '__main__':
             print >>sys.stderr, 'DEBUG: Options and Arguments:'
             for o,a in opts:
                 print >>sys.stderr, 'DEBUG:   ', o, a
-        for inputline in fileinput.input(args):
-            try:
-                for line in csv.reader([inputline], escapechar='\\'):
-                    if show_backups :
-                        if line[1] != '0' or line[5] == '-' :
-                            # if it's NOT a type=backup ('0') or the schedule IS '-' (aka parent job for
-                            # DB's or Exchange), continue
-                            continue
-                    try:
-                        d, exc, buf_debug = process_line(line)
-                        if exc:
-                            raise
-                    except:
-                        if debug_mode:
-                            print >>sys.stderr, 'DEBUG:  ', '*'*30
-                            print >>sys.stderr, 'DEBUG:   Filename:            ', fileinput.filename()
-                            print >>sys.stderr, 'DEBUG:   Line Number:         ', fileinput.lineno()
-                            print >>sys.stderr, 'DEBUG:   Exception:           ', exc[0]
-                            print >>sys.stderr, 'DEBUG:   Exception:           ', exc[1]
-                            print >>sys.stderr, 'DEBUG:   Dict Contents:       '
-                            output_debug_dict(d)
-                            print >>sys.stderr, 'DEBUG:   ', buf_debug
-                            print >>sys.stderr, 'DEBUG:   ', line
-                            print >>sys.stderr, 'DEBUG:  ', '*'*30
-                        else:
-                            print >>sys.stderr, 'ERROR: ', line
-                    else:
-                        try:
-                            if int(d['start']) >= start_date and int(d['start']) <= end_date:
-                                # To make this cleaner, maybe cross check dicts based on
-                                # the assumption that Done jobs are the most important?
-                                if int(d['state']) == 0:
-                                    if not queued_master.get(d['jobid']):
-                                        try:
-                                            queued_master[d['jobid']].append(d)
-                                        except:
-                                            queued_master[d['jobid']] = d
-                                elif int(d['state']) == 1:
-                                    if not active_master.get(d['jobid']):
-                                        try:
-                                            active_master[d['jobid']].append(d)
-                                        except:
-                                            active_master[d['jobid']] = d
-                                elif int(d['state']) == 2:
-                                    if not requeued_master.get(d['jobid']):
-                                        try:
-                                            requeued_master[d['jobid']].append(d)
-                                        except:
-                                            requeued_master[d['jobid']] = d
-                                elif int(d['state']) == 3:
-                                    if not done_master.get(d['jobid']):
-                                        try:
-                                            done_master[d['jobid']].append(d)
-                                        except:
-                                            done_master[d['jobid']] = d
-                        except:
-                            if debug_mode:
-                                exc = sys.exc_info()
-                                print >>sys.stderr, 'DEBUG:  ', '*'*30
-                                print >>sys.stderr, 'DEBUG:   Filename:            ', fileinput.filename()
-                                print >>sys.stderr, 'DEBUG:   Line Number:         ', fileinput.lineno()
-                                print >>sys.stderr, 'DEBUG:   Exception:           ', exc[0]
-                                print >>sys.stderr, 'DEBUG:   Exception:           ', exc[1]
-                                print >>sys.stderr, 'DEBUG:   Dict Contents:       '
-                                output_debug_dict(d)
-                                print >>sys.stderr, 'DEBUG:   ', buf_debug
-                                print >>sys.stderr, 'DEBUG:   ', line
-                                print >>sys.stderr, 'DEBUG:  ', '*'*30
-                            else:
-                                print >>sys.stderr, 'ERROR: ', line
-            except:
-                print >>sys.stderr, 'ERROR: ', inputline
+        # debug mode wants to see every bad record, so nothing is dropped early
+        prefilter = None
+        if not debug_mode:
+            shown = output or columns_path
+            if store_path or segments_path or (show_all and shown):
+                states = ( '0', '1', '2', '3' )
+            elif (show_active or follow_interval) and shown:
+                # --follow is about the jobs running now as well
+                states = ( '1', '3' )
+            else:
+                states = ( '3', )
+            prefilter = Prefilter(start_date, end_date, show_backups, states)
+        elif state_file:
+            print >>sys.stderr, 'DEBUG:   --state_file is ignored in debug mode'
+            state_file = ''
+        unchanged = False
+        if state_file:
+            state = load_state(state_file)
+            inputs = input_signature(args)
+            unchanged = inputs is not None and inputs == state['inputs']
+            prefilter.incremental(state['hwm'], state['flux'])
+        masters = ( queued_master, active_master, requeued_master, done_master )
+        if group_by:
+            # the states that would be printed fold into one Aggregator,
+            # the rest into one that keeps no totals worth printing
+            aggregator = Aggregator(group_by, aggs)
+            discard = Aggregator([], [])
+            wanted = [ 3 ]
+            if show_active:
+                wanted.append(1)
+            if show_all:
+                wanted.extend([ 0, 1, 2 ])
+            masters = tuple([ ( discard, aggregator )[state in wanted].state() for state in range(4) ])
+        parse_start = time.time()
+        if follow_interval:
+            # polls until ^C, writing only what changed
+            if output and print_the_header:
+                print_header(col_fmt,done_master)
+            follow(args, follow_cmd, follow_interval, prefilter,
+                   [ int(state) for state in prefilter.states ], col_fmt,
+                   follow_window)
+            if profile:
+                write_profile(profile_path, profile, prefilter, masters, sys.stdout)
+            sys.exit()
+        if merge_mode:
+            # parsed (per dump) while the merged rows are written below
+            lines = records = 0
+        elif unchanged:
+            # same dump as last time, nothing new to report
+            lines = records = 0
+        elif jobs > 1 and '-' not in args:
+            lines, records = parse_parallel(args, jobs, masters, prefilter)
+        else:
+            reader = open_reader(args, prefilter)
+            parse_input(reader, masters)
+            lines, records = reader.lines, reader.records
+        if show_stats:
+            report_stats(lines, records, prefilter and prefilter.dropped, time.time() - parse_start)
 
-        if format_file:
-            col_fmt = get_output_cols(format_file)
-        if output:
+        if group_by:
+            if output:
+                if print_the_header :
+                    print aggregator.header()
+                rows = aggregator.rows()
+                if rows:
+                    rows.append('')
+                    sys.stdout.write('\n'.join(rows))
+        elif merge_mode:
+            states = [ 3 ]
+            if show_active:
+                states.append(1)
+            if show_all:
+                states.extend([ 1, 0, 2 ])
+            if output:
+                if print_the_header :
+                    print_header(col_fmt,done_master)
+                write_rows(merge_masters(args, prefilter, states), col_fmt)
+        elif output:
             if not all_data:
                 if print_the_header :
                     print_header(col_fmt,done_master)
@@ -810,8 +2437,40 @@ if __name__ == '__main__':
                 output_data(requeued_master, col_fmt)
         if shelve_dicts:
             fp_output = open(pkl, 'wb')
-            cPickle.dump(done_master,fp_output,1)
+            # plain dicts, so the pickle does not depend on JobRecord
+            cPickle.dump(dict([ (jobid, job.as_dict()) for jobid, job in done_master.iteritems() ]),fp_output,1)
             fp_output.close()
+        if store_path:
+            conn = bpdbstore.open_store(store_path)
+            jobs_stored = 0
+            for master in masters:
+                jobs_stored += bpdbstore.store_jobs(conn, master.itervalues())
+            conn.close()
+            if show_stats:
+                print >>sys.stderr, 'STATS:    jobs stored:         ', jobs_stored
+        if columns_path:
+            # in the order output_data would have written them
+            written = [ done_master ]
+            if show_active:
+                written.append(active_master)
+            if show_all:
+                written.extend([ active_master, queued_master, requeued_master ])
+            rows_written = bpdbcolumns.write_columns(columns_path,
+                column_rows([ master[key] for master in written for key in sorted(master.keys()) ]))
+            if show_stats:
+                print >>sys.stderr, 'STATS:    column rows written: ', rows_written
+        if segments_path:
+            jobs_stored = 0
+            for master in masters:
+                jobs_stored += bpdbsegments.append_jobs(segments_path, master.itervalues())
+            if show_stats:
+                print >>sys.stderr, 'STATS:    jobs appended:       ', jobs_stored
+        if state_file and not unchanged:
+            emitted = set([ job.jobid for job in done_master.itervalues() if type(job.jobid) is int ])
+            hwm, flux = next_state(state['hwm'], prefilter.seen, emitted)
+            save_state(state_file, hwm, flux, inputs)
+        if profile:
+            write_profile(profile_path, profile, prefilter, masters, sys.stdout)
 
     except KeyboardInterrupt:   # Catch premature ^C
         traceback.print_tb(sys.exc_traceback)
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+#
+# bpdbsegments.py
+#
+# Day-partitioned job store for bpdbreport.py --segments, and a small
+# query front end for it.
+#
+# The store is a directory with one segment per day (by job start, local
+# time):
+#
+#   20121012.seg      compacted jobs of that day, one entry per jobid
+#   20121012.delta    batches appended by later loads, not yet compacted
+#   20121012.delta.compacting
+#                     deltas a compaction has taken over, folded into the
+#                     segment and then removed
+#   index.json        per day: the latest tryended seen, so a query knows
+#                     which earlier days still reach into its window
+#   index.lock        held by a load while it updates index.json, so
+#                     loads running together do not drop each other's days
+#
+# Loading only appends to the delta files of the days it touches.
+# Compaction folds a day's deltas into its segment, and can run while
+# loads go on: it first renames the delta aside, so later batches start
+# a new one, and locks the renamed file so a load that opened it just
+# before the rename finishes writing first (or moves over to the new
+# delta).  Either way a job is
+# only replaced by a record in the same or a more advanced state
+# (Queued < Re-Queued < Active < Done), as in bpdbstore.py.
+#
+# Query usage:
+#
+#   bpdbsegments.py -c client [-s dd/mmm/yyyy] [-e dd/mmm/yyyy] store_dir
+#   bpdbsegments.py --compact store_dir
+#
+# Queries print client,class,sched,trystarted,tryended like bpdbstore.py
+# and only open the segments of days that can overlap -s/-e.
+
+import os
+import sys
+import time
+import json
+import fcntl
+import getopt
+import cPickle
+
+import bpdbstore
+
+#############################################################################
+
+index_name = 'index.json'
+lock_name = 'index.lock'
+
+client_idx = bpdbstore.job_columns.index('client')
+class_idx = bpdbstore.job_columns.index('class')
+sched_idx = bpdbstore.job_columns.index('sched')
+# try rows start with jobid, trynum
+trystarted_idx = bpdbstore.try_columns.index('trystarted') + 2
+tryended_idx = bpdbstore.try_columns.index('tryended') + 2
+
+#############################################################################
+
+def usage():
+    print >>sys.stderr, '''\nbpdbsegments.py usage:
+
+    bpdbsegments.py [switches] store_dir
+
+    -c client                only show tries for this client
+    -s dd/mmm/yyyy           tries that end on or after this day
+    -e dd/mmm/yyyy           tries that start on or before this day
+    --compact                fold every day's deltas into its segment
+    -h                       print this help and exit
+
+    Output is client,class,sched,trystarted,tryended, one line per try.
+'''
+
+#############################################################################
+
+def day_of( seconds ):
+    return time.strftime('%Y%m%d', time.localtime(seconds))
+
+def day_start( day ):
+    return time.mktime(time.strptime(day, '%Y%m%d'))
+
+def segment_path( store, day ):
+    return os.path.join(store, day + '.seg')
+
+def delta_path( store, day ):
+    return os.path.join(store, day + '.delta')
+
+def compacting_path( store, day ):
+    return delta_path(store, day) + '.compacting'
+
+def load_index( store ):
+    try:
+        return json.load(open(os.path.join(store, index_name)))
+    except (IOError, ValueError):
+        return {}
+
+def save_index( store, index ):
+    path = os.path.join(store, index_name)
+    # a tmp file of its own, in case a save without the lock runs along
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = open(tmp, 'w')
+    json.dump(index, fp)
+    fp.close()
+    os.rename(tmp, path)
+
+def update_index( store, ends ):
+    ''' Raise the index entries of the days in { day : latest end } under
+    the store's lock, re-reading the index so days another load added in
+    the meantime are kept.'''
+    lock = open(os.path.join(store, lock_name), 'ab')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = load_index(store)
+        for day, last in ends.iteritems():
+            index[day] = max(index.get(day, 0), last)
+        save_index(store, index)
+    finally:
+        lock.close()
+
+def job_entry( job ):
+    ''' (jobid, rank, job row, try rows) for one JobRecord.'''
+    row = bpdbstore.job_row(job)
+    tries = [ bpdbstore.try_row(job.jobid, trynum + 1, job_try)
+              for trynum, job_try in enumerate(job.tries) ]
+    return ( job.jobid, row[-1], tuple(row), tries )
+
+def entry_end( entry ):
+    ''' Latest time the entry covers, for the index.'''
+    ends = [ t[tryended_idx] for t in entry[3] if type(t[tryended_idx]) is int ]
+    end = entry[2][bpdbstore.job_columns.index('end')]
+    if type(end) is int:
+        ends.append(end)
+    if ends:
+        return max(ends)
+    return 0
+
+def fold( jobs, entries ):
+    ''' Add entries to { jobid : entry }, later ones replacing earlier ones
+    of the same or a lower rank.'''
+    for entry in entries:
+        current = jobs.get(entry[0])
+        if current is None or entry[1] >= current[1]:
+            jobs[entry[0]] = entry
+    return jobs
+
+#############################################################################
+
+def append_jobs( store, jobs ):
+    ''' Append an iterable of JobRecords to the delta files of their start
+    days.  Returns the number of jobs written.'''
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    days = {}
+    for job in jobs:
+        if type(job.jobid) is not int or type(job.start) is not int:
+            continue
+        days.setdefault(day_of(job.start), []).append(job_entry(job))
+    ends = {}
+    written = 0
+    for day, entries in days.iteritems():
+        path = delta_path(store, day)
+        while True:
+            fp = open(path, 'ab')
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            # a compaction may have renamed the file between the open and
+            # the lock; then it is no longer the delta, so start a new one
+            try:
+                if os.fstat(fp.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except OSError:
+                pass
+            fp.close()
+        cPickle.dump(entries, fp, 2)
+        fp.close()
+        ends[day] = max([ entry_end(e) for e in entries ])
+        written += len(entries)
+    update_index(store, ends)
+    return written
+
+def read_deltas( jobs, path ):
+    ''' Fold the batches of one delta file into jobs, if it exists.'''
+    if os.path.exists(path):
+        fp = open(path, 'rb')
+        while True:
+            try:
+                fold(jobs, cPickle.load(fp))
+            except EOFError:
+                break
+        fp.close()
+    return jobs
+
+def read_segment( store, day ):
+    ''' { jobid : entry } of a day's compacted segment, or an empty dict.'''
+    if os.path.exists(segment_path(store, day)):
+        fp = open(segment_path(store, day), 'rb')
+        jobs = cPickle.load(fp)
+        fp.close()
+        return jobs
+    return {}
+
+def read_day( store, day ):
+    ''' { jobid : entry } for one day: its segment plus any deltas, the
+    ones a compaction is working on before the newer ones.'''
+    jobs = read_segment(store, day)
+    read_deltas(jobs, compacting_path(store, day))
+    read_deltas(jobs, delta_path(store, day))
+    return jobs
+
+def compact( store, days=None ):
+    ''' Fold the deltas of days (all days by default) into their segments.
+    Returns the number of days compacted.'''
+    if days is None:
+        days = set([ name.split('.')[0] for name in os.listdir(store)
+                     if name.endswith('.delta') or name.endswith('.delta.compacting') ])
+    compacted = 0
+    for day in days:
+        held = compacting_path(store, day)
+        # one left over from a compaction that did not finish is taken
+        # as it is; the current delta waits for the next compaction
+        if not os.path.exists(held):
+            if not os.path.exists(delta_path(store, day)):
+                continue
+            os.rename(delta_path(store, day), held)
+        fp = open(held, 'rb')
+        # wait for a load that opened the delta before the rename
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        fp.close()
+        jobs = read_deltas(read_segment(store, day), held)
+        path = segment_path(store, day)
+        fp = open(path + '.tmp', 'wb')
+        cPickle.dump(jobs, fp, 2)
+        fp.close()
+        os.rename(path + '.tmp', path)
+        os.remove(held)
+        compacted += 1
+    return compacted
+
+#############################################################################
+
+def query_days( store, start=None, end=None ):
+    ''' The days whose segments can hold a try overlapping start..end:
+    started on or before end, and still running on or after start.'''
+    days = []
+    for day, last in load_index(store).iteritems():
+        if end is not None and day_start(day) > end:
+            continue
+        if start is not None and last < start:
+            continue
+        days.append(day)
+    days.sort()
+    return days
+
+def query_tries( store, client=None, start=None, end=None ):
+    ''' Rows of (client, class, sched, trystarted, tryended) for the tries
+    of client that overlap start..end, ordered by trystarted.'''
+    rows = []
+    for day in query_days(store, start, end):
+        for jobid, rank, job, tries in read_day(store, day).itervalues():
+            if client is not None and job[client_idx] != client:
+                continue
+            for job_try in tries:
+                started = job_try[trystarted_idx]
+                ended = job_try[tryended_idx]
+                if start is not None and (ended is None or ended < start):
+                    continue
+                if end is not None and (started is None or started > end):
+                    continue
+                rows.append(( started, job[client_idx], job[class_idx],
+                              job[sched_idx], ended ))
+    rows.sort()
+    return [ ( c, k, s, started, ended ) for started, c, k, s, ended in rows ]
+
+#############################################################################
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:s:e:h", ["compact"])
+    except getopt.GetoptError, msg:
+        print "Usage Error:", repr(msg)
+        usage()
+        sys.exit(2)
+
+    client = None
+    start_date = None
+    end_date = None
+    compact_only = False
+    for o, a in opts:
+        if o == "-h":
+            usage()
+            sys.exit()
+        if o == "-c":
+            client = a
+        if o == "--compact":
+            compact_only = True
+        if o in ("-s", "-e"):
+            try:
+                date = time.mktime(time.strptime(a, '%d/%b/%Y'))
+            except:
+                print >>sys.stderr, '\nDate values must be in dd/mmm/yyyy format'
+                usage()
+                sys.exit(1)
+            if o == "-s":
+                start_date = date
+            else:
+                end_date = date + 86399   # Add 23:59:59 to enddate to include that day
+
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        usage()
+        sys.exit(1)
+
+    if compact_only:
+        print >>sys.stderr, 'compacted', compact(args[0]), 'days'
+        sys.exit()
+    for row in query_tries(args[0], client, start_date, end_date):
+        print ','.join([ str(value) for value in row ])
+
+# modeline vim:set ts=4 sw=4 et:
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+#
+# bpdbstore.py
+#
+# SQLite job store for bpdbreport.py --store, and a small query
+# front end for it.
+#
+# Jobs and tries are upserted by jobid.  Loading the same or an
+# overlapping bpdbjobs dump again is harmless: a job is only replaced
+# by a record in the same or a more advanced state
+# (Queued < Re-Queued < Active < Done).
+#
+# Query usage:
+#
+#   bpdbstore.py -c client [-s dd/mmm/yyyy] [-e dd/mmm/yyyy] store.db
+#
+# prints client,class,sched,trystarted,tryended for every try of that
+# client that overlaps the window, which is the same layout sample.fmt
+# produces and produce_gantt.py reads.
+
+import os
+import sys
+import time
+import getopt
+import sqlite3
+
+#############################################################################
+
+job_columns = ( 'jobid', 'jobtype', 'state', 'status', 'class', 'sched',
+                'client', 'server', 'start', 'elapsed', 'end', 'stunit',
+                'try', 'operation', 'kbytes', 'files', 'path_last_written',
+                'percent', 'jobpid', 'owner', 'subtype', 'classtype',
+                'schedtype', 'priority', 'group', 'master_server',
+                'retention_units', 'retention_period', 'compression',
+                'kbyteslastwritten', 'fileslastwritten', 'filelistcount',
+                'filelist', 'trycount',
+                'parentjob', 'kbpersec', 'copy', 'robot', 'vault', 'profile',
+                'session', 'ejecttapes', 'srcstunit', 'srcserver', 'srcmedia',
+                'dstmedia', 'stream',
+                'suspendable', 'resumable', 'restartable', 'datamovement',
+                'frozenimage', 'backupid', 'killable', 'controllinghost' )
+try_columns = ( 'trypid', 'trystunit', 'tryserver', 'trystarted', 'tryelapsed',
+                'tryended', 'trystatus', 'trystatusdescription', 'trystatuscount',
+                'trystatuslines', 'trybyteswritten', 'tryfileswritten' )
+
+# how far along a job is, by state.  Higher replaces lower.
+state_rank = { 0 : 0, 2 : 1, 1 : 2, 3 : 3 }
+
+indexes = ( ( 'jobs', 'client' ), ( 'jobs', 'class' ), ( 'jobs', 'sched' ),
+            ( 'jobs', 'start' ), ( 'jobs', 'end' ),
+            ( 'tries', 'trystarted' ), ( 'tries', 'tryended' ) )
+
+#############################################################################
+
+def usage():
+    print >>sys.stderr, '''\nbpdbstore.py usage:
+
+    bpdbstore.py [switches] store.db
+
+    -c client                only show tries for this client
+    -s dd/mmm/yyyy           tries that end on or after this day
+    -e dd/mmm/yyyy           tries that start on or before this day
+    -h                       print this help and exit
+
+    Output is client,class,sched,trystarted,tryended, one line per try.
+'''
+
+#############################################################################
+
+def quote( name ):
+    # class, group, try and end are all SQL keywords
+    return '"%s"' % name
+
+def open_store( path ):
+    ''' Open (and create if needed) the job store at path.'''
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    conn.execute('CREATE TABLE IF NOT EXISTS jobs (%s, rank INTEGER, PRIMARY KEY (jobid))' %
+                 ', '.join([ quote(c) for c in job_columns ]))
+    conn.execute('CREATE TABLE IF NOT EXISTS tries (jobid INTEGER, trynum INTEGER, %s, PRIMARY KEY (jobid, trynum))' %
+                 ', '.join([ quote(c) for c in try_columns ]))
+    for table, column in indexes:
+        conn.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %
+                     (table, column, table, quote(column)))
+    return conn
+
+def job_row( job ):
+    row = []
+    for column in job_columns:
+        value = getattr(job, column, None)
+        if column == 'filelist' and value is not None:
+            value = '\n'.join(value)
+        row.append(value)
+    row.append(state_rank.get(job.state, -1))
+    return row
+
+def try_row( jobid, trynum, job_try ):
+    row = [ jobid, trynum ]
+    for column in try_columns:
+        value = getattr(job_try, column, None)
+        if column == 'trystatuslines' and value is not None:
+            value = '\n'.join(value)
+        row.append(value)
+    return row
+
+def current_ranks( conn, jobids ):
+    ranks = {}
+    for i in range(0, len(jobids), 500):
+        batch = jobids[i:i+500]
+        for jobid, rank in conn.execute('SELECT jobid, rank FROM jobs WHERE jobid IN (%s)' %
+                                        ','.join('?' * len(batch)), batch):
+            ranks[jobid] = rank
+    return ranks
+
+def store_jobs( conn, jobs ):
+    ''' Upsert an iterable of JobRecords.  A job already in the store is
+    only replaced by one in the same or a more advanced state.  Returns the
+    number of jobs written.'''
+    jobs = [ job for job in jobs if type(job.jobid) is int ]
+    ranks = current_ranks(conn, [ job.jobid for job in jobs ])
+    latest = {}
+    for job in jobs:
+        rank = state_rank.get(job.state, -1)
+        if rank < ranks.get(job.jobid, -1):
+            continue
+        if job.jobid in latest and rank < state_rank.get(latest[job.jobid].state, -1):
+            continue
+        latest[job.jobid] = job
+    job_rows = [ job_row(job) for job in latest.itervalues() ]
+    try_rows = []
+    for job in latest.itervalues():
+        for trynum, job_try in enumerate(job.tries):
+            try_rows.append(try_row(job.jobid, trynum + 1, job_try))
+    conn.executemany('INSERT OR REPLACE INTO jobs VALUES (%s)' %
+                     ','.join('?' * (len(job_columns) + 1)), job_rows)
+    conn.executemany('DELETE FROM tries WHERE jobid = ?',
+                     [ (jobid,) for jobid in latest ])
+    conn.executemany('INSERT INTO tries VALUES (%s)' %
+                     ','.join('?' * (len(try_columns) + 2)), try_rows)
+    conn.commit()
+    return len(job_rows)
+
+#############################################################################
+
+def query_tries( conn, client=None, start=None, end=None ):
+    ''' Tries (joined with their job) for client that overlap start..end.
+    Any of the three can be left out.  Returns rows of
+    (client, class, sched, trystarted, tryended) ordered by trystarted.'''
+    where = []
+    args = []
+    if client is not None:
+        where.append('jobs.client = ?')
+        args.append(client)
+    if start is not None:
+        where.append('tries.tryended >= ?')
+        args.append(int(start))
+    if end is not None:
+        where.append('tries.trystarted <= ?')
+        args.append(int(end))
+    sql = '''SELECT jobs.client, jobs."class", jobs.sched, tries.trystarted, tries.tryended
+             FROM tries JOIN jobs ON jobs.jobid = tries.jobid'''
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY tries.trystarted'
+    return conn.execute(sql, args)
+
+#############################################################################
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:s:e:h")
+    except getopt.GetoptError, msg:
+        print "Usage Error:", repr(msg)
+        usage()
+        sys.exit(2)
+
+    client = None
+    start_date = None
+    end_date = None
+    for o, a in opts:
+        if o == "-h":
+            usage()
+            sys.exit()
+        if o == "-c":
+            client = a
+        if o in ("-s", "-e"):
+            try:
+                date = time.mktime(time.strptime(a, '%d/%b/%Y'))
+            except:
+                print >>sys.stderr, '\nDate values must be in dd/mmm/yyyy format'
+                usage()
+                sys.exit(1)
+            if o == "-s":
+                start_date = date
+            else:
+                end_date = date + 86399   # Add 23:59:59 to enddate to include that day
+
+    if len(args) != 1 or not os.path.isfile(args[0]):
+        usage()
+        sys.exit(1)
+
+    conn = open_store(args[0])
+    for row in query_tries(conn, client, start_date, end_date):
+        print ','.join([ str(value) for value in row ])
+    conn.close()
+
+# modeline vim:set ts=4 sw=4 et:
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+#
+# gendump.py
+#
+# Writes a made-up 'bpdbjobs -report -all_columns' dump, for trying
+# bpdbreport.py (and benchmark.py) on something the size of a real master
+# server without taking a real dump off the backup network.
+#
+# The records follow the layout bpdbreport.py parses: the job columns,
+# the filelist, each try with its status lines, and then the 4.x and 5.x
+# columns if the layout has them.  Commas in paths and status text are
+# escaped with a backslash and some records have an escaped newline in a
+# try's status lines, as bpdbjobs does.  Jobs are listed newest first.
+#
+# Usage:
+#
+#   gendump.py [-n jobs] [-l 3x|4x|5x|mix] [-t tries] [-f files] [-m lines]
+#              [-x percent] [-s dd/mmm/yyyy] [-d days] [-c clients]
+#              [--seed n] [-o file]
+#
+# The same switches give the same dump.
+
+import sys
+import time
+import random
+import getopt
+
+#############################################################################
+
+layouts = ( '3x', '4x', '5x' )
+
+# (value, weight)
+job_types = ( ( 0, 85 ), ( 4, 6 ), ( 3, 4 ), ( 2, 3 ), ( 6, 2 ) )
+job_states = ( ( 3, 88 ), ( 1, 7 ), ( 0, 3 ), ( 2, 2 ) )
+schedules = ( ( 'Full', 0, 20 ), ( 'Differential', 1, 55 ), ( 'Cumulative', 4, 20 ),
+              ( '-', 0, 5 ) )
+# status of a try that failed and was tried again
+retry_status = ( 196, 96, 13, 41, 24, 58 )
+
+status_text = ( 'requesting resource %(stunit)s',
+                'granted resource %(media)s',
+                'estimated %(kbytes)d kbytes needed',
+                'started process bpbrm (pid=%(pid)d)',
+                'connecting',
+                'connected; connect time: 0:00:00',
+                'begin writing',
+                'mounted %(media)s, drive 2 (/dev/rmt/2cbn)',
+                'positioning %(media)s to file 12',
+                'end writing; write time: 0:%(minutes)02d:12',
+                'Info bpbrm (pid=%(pid)d) %(client)s is the host to backup data from',
+                'Warning bpbrm (pid=%(pid)d) from client %(client)s: WRN - can\'t open file: /var/tmp/x, skipping' )
+
+#############################################################################
+
+def usage():
+    print >>sys.stderr, '''\ngendump.py usage:
+
+    gendump.py [switches]
+
+    -n jobs                  number of jobs (default 10000)
+    -l 3x|4x|5x|mix          column layout, mix takes a third of each
+                               (default 5x)
+    -t tries                 at most this many tries per job (default 3)
+    -f files                 at most this many filelist entries (default 4)
+    -m lines                 at most this many status lines per try (default 10)
+    -x percent               records with escaped commas in paths and text,
+                               and escaped newlines in status lines (default 5)
+    -s dd/mmm/yyyy           first day jobs start on (default 01/Oct/2012)
+    -d days                  number of days jobs start on (default 7)
+    -c clients               number of clients (default 200)
+    --seed n                 random seed (default 1)
+    -o file                  write to file instead of stdout
+    -h                       print this help and exit
+'''
+
+#############################################################################
+
+def weighted( rng, choices ):
+    ''' First field of one of choices, picked by the weight in its last field.'''
+    pick = rng.uniform(0, sum([ choice[-1] for choice in choices ]))
+    for choice in choices:
+        pick -= choice[-1]
+        if pick <= 0:
+            return choice
+    return choices[-1]
+
+def escape( text ):
+    ''' Text the way bpdbjobs writes it into a csv field.'''
+    return text.replace('\\', '\\\\').replace(',', '\\,').replace('\n', '\\\n')
+
+class Generator(object):
+    ''' Makes the records of one dump.  record(jobid) gives the line for a
+    job; write(fp) writes the whole dump.'''
+    def __init__(self, jobs=10000, layout='5x', tries=3, files=4, lines=10,
+                 escapes=5, start=None, days=7, clients=200, seed=1):
+        self.jobs = jobs
+        self.layout = layout
+        self.tries = max(1, tries)
+        self.files = files
+        self.lines = lines
+        self.escapes = escapes / 100.0
+        if start is None:
+            start = time.mktime(time.strptime('01/Oct/2012', '%d/%b/%Y'))
+        self.start = int(start)
+        self.days = max(1, days)
+        self.rng = random.Random(seed)
+        self.clients = [ 'host%d.example.com' % n for n in range(clients) ]
+        self.policies = [ 'pol_%s' % name for name in ( 'unix', 'windows', 'oracle',
+                                                        'exchange', 'catalog', 'nas' ) ]
+        self.servers = [ 'media%d' % n for n in range(1, 5) ]
+        self.masters = [ 'master1' ]
+
+    def statuslines(self, when, values, escaped):
+        lines = []
+        for number in range(self.rng.randint(0, self.lines)):
+            text = status_text[number % len(status_text)] % values
+            stamp = time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(when + number * 7))
+            line = '%s - %s' % (stamp, text)
+            if escaped and number == 1:
+                line += '\nand continued on a second line'
+            lines.append(escape(line))
+        return lines
+
+    def try_fields(self, start, elapsed, status, values, escaped):
+        end = start + elapsed
+        fields = [ str(self.rng.randint(1000, 65000)), values['stunit'], values['server'],
+                   str(start), str(elapsed), str(end), str(status),
+                   escape('the requested operation was successfully completed')
+                   if status == 0 else escape('media write error, retrying') ]
+        lines = self.statuslines(start, values, escaped)
+        fields.append(str(len(lines)))
+        fields.extend(lines)
+        fields.append(str(values['kbytes'] * (status == 0)))
+        fields.append(str(values['files'] * (status == 0)))
+        return fields
+
+    def record(self, jobid):
+        rng = self.rng
+        jobtype = weighted(rng, job_types)[0]
+        state = weighted(rng, job_states)[0]
+        sched, schedtype = weighted(rng, schedules)[:2]
+        client = rng.choice(self.clients)
+        server = rng.choice(self.servers)
+        stunit = 'stu_' + server
+        start = self.start + rng.randint(0, self.days * 86400 - 1)
+        elapsed = rng.randint(30, 6 * 3600)
+        escaped = rng.random() < self.escapes
+        layout = self.layout
+        if layout == 'mix':
+            layout = layouts[jobid % len(layouts)]
+        values = { 'stunit' : stunit, 'server' : server, 'client' : client,
+                   'media' : 'A%05d' % rng.randint(0, 99999),
+                   'pid' : rng.randint(1000, 65000), 'minutes' : elapsed // 60 % 60,
+                   'kbytes' : rng.randint(0, 50000000), 'files' : rng.randint(0, 400000) }
+
+        # tries: every one but the last failed, the last one is still
+        # going unless the job is done
+        trycount = 0
+        if state != 0:
+            trycount = rng.randint(1, self.tries)
+        tries = []
+        when = start
+        status = ''
+        for number in range(trycount):
+            last = number == trycount - 1
+            if last:
+                try_status = rng.choice(( 0, 0, 0, 0, 0, 0, 1, 71 ))
+            else:
+                try_status = rng.choice(retry_status)
+            try_elapsed = max(1, elapsed // trycount)
+            tries.extend(self.try_fields(when, try_elapsed, try_status, values, escaped and last))
+            when += try_elapsed + 600
+            status = try_status
+        if state == 3:
+            end = str(start + elapsed)
+        else:
+            end = ''
+            status = ''
+            elapsed = 0
+
+        path = '/export/home/user%d/data/file%d.dat' % (rng.randint(0, 999), rng.randint(0, 99999))
+        if escaped:
+            path = path.replace('/data/', '/data, old/')
+        filelist = [ '/export/home/user%d' % n for n in range(rng.randint(0, self.files)) ]
+        if escaped and filelist:
+            filelist[-1] += ', archived'
+        percent = 100
+        if state != 3:
+            percent = rng.randint(0, 99)
+        fields = [ str(jobid), str(jobtype), str(state), str(status),
+                   rng.choice(self.policies), sched, client, server,
+                   str(start), str(elapsed), end, stunit, str(trycount),
+                   str(rng.choice(( 0, 1, 2, 3 ))) if state == 1 else '',
+                   str(values['kbytes']), str(values['files']), escape(path),
+                   str(percent), str(values['pid']), 'root',
+                   str(rng.choice(( 0, 1 ))), str(rng.choice(( 0, 0, 13, 4 ))),
+                   str(schedtype), '0', 'other', rng.choice(self.masters),
+                   '1', str(rng.choice(( 1, 2, 3, 9 ))), '0',
+                   str(values['kbytes']), str(values['files']),
+                   str(len(filelist)) ]
+        fields.extend([ escape(entry) for entry in filelist ])
+        fields.append(str(trycount))
+        fields.extend(tries)
+        if layout in ( '4x', '5x' ):
+            fields.extend([ str(jobid), str(rng.randint(1000, 90000)), '1', '', '', '',
+                            '1', '0', stunit, server, '', '', '0' ])
+        if layout == '5x':
+            fields.extend([ '0', '1', '1', '0', '0',
+                            '%s_%d' % (client, start), '1', server ])
+        return ','.join(fields)
+
+    def write(self, fp):
+        ''' The whole dump, newest job first.  Returns the bytes written.'''
+        written = 0
+        out = []
+        for jobid in range(self.jobs, 0, -1):
+            out.append(self.record(jobid))
+            if len(out) >= 10000:
+                out.append('')
+                block = '\n'.join(out)
+                fp.write(block)
+                written += len(block)
+                out = []
+        if out:
+            out.append('')
+            block = '\n'.join(out)
+            fp.write(block)
+            written += len(block)
+        return written
+
+#############################################################################
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:l:t:f:m:x:s:d:c:o:h", ["seed="])
+    except getopt.GetoptError, msg:
+        print "Usage Error:", repr(msg)
+        usage()
+        sys.exit(2)
+
+    settings = {}
+    output = None
+    numbers = { '-n' : 'jobs', '-t' : 'tries', '-f' : 'files', '-m' : 'lines',
+                '-x' : 'escapes', '-d' : 'days', '-c' : 'clients', '--seed' : 'seed' }
+    for o, a in opts:
+        if o == "-h":
+            usage()
+            sys.exit()
+        if o in numbers:
+            try:
+                settings[numbers[o]] = int(a)
+            except ValueError:
+                print >>sys.stderr, '\n%s needs a number' % o
+                usage()
+                sys.exit(1)
+        if o == "-l":
+            if a not in layouts and a != 'mix':
+                print >>sys.stderr, '\n-l must be one of 3x, 4x, 5x or mix'
+                usage()
+                sys.exit(1)
+            settings['layout'] = a
+        if o == "-s":
+            try:
+                settings['start'] = time.mktime(time.strptime(a, '%d/%b/%Y'))
+            except:
+                print >>sys.stderr, '\nDate values must be in dd/mmm/yyyy format'
+                usage()
+                sys.exit(1)
+        if o == "-o":
+            output = a
+
+    if output:
+        fp = open(output, 'wb')
+    else:
+        fp = sys.stdout
+    Generator(**settings).write(fp)
+    if fp is not sys.stdout:
+        fp.close()
+
+# modeline vim:set ts=4 sw=4 et:
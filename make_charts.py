@@ -0,0 +1,184 @@
+#!/usr/bin/python
+#
+# make_charts.py
+#
+# Does what runme does (bpdbreport.py -> cleanup.sh -> grep -> four
+# produce_gantt.py runs) in one process: the bpdbjobs dump is parsed
+# once, the hostname/schedule cleanup (cleanup.sed) is done in memory,
+# the rows are split into the All/Full/Cumulative/Differential views in
+# the same pass and the four charts are drawn from those shared rows.
+#
+# Usage:
+#
+#   make_charts.py [-s dd/mmm/yyyy] [-e dd/mmm/yyyy] [-o dir] [-r rules.sed]
+#                  [--packed] [--flat] [--budget pixels] [--stats]
+#                  [bpdbjobs.out]
+#
+# Writes all.svg, full.svg, cumm.svg and diff.svg (into dir if given).
+# The window defaults to yesterday onwards, as in runme.
+
+import os
+import sys
+import time
+import getopt
+import resource
+
+import bpdbreport
+import produce_gantt
+import rewrite
+
+#############################################################################
+
+# cleanup.sh's rules, next to this script unless -r says otherwise
+default_rules = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleanup.sed')
+
+# chart name, and the text a row must contain to be on it ('' is every row)
+views = ( ( 'all', '' ), ( 'full', 'Full' ), ( 'cumm', 'Cum' ), ( 'diff', 'Diff' ) )
+
+chart_columns = ( 'client', 'class', 'sched' )
+
+#############################################################################
+
+def usage():
+    print >>sys.stderr, '''\nmake_charts.py usage:
+
+    make_charts.py [switches] [bpdbjobs.out]
+
+    -s dd/mmm/yyyy           first day to chart (default: yesterday)
+    -e dd/mmm/yyyy           last day to chart (default: now)
+    -o dir                   write the SVG files into dir
+    -r rules.sed             label cleanup rules (default: cleanup.sed)
+    --packed                 let jobs that do not overlap share a row
+    --flat                   draw plain solid bars: a much smaller SVG
+    --budget pixels          keep each chart about this many pixels high,
+                               drawn with less detail as rows get thinner
+    --stats                  print wall time and peak RSS to stderr
+    -h                       print this help and exit
+
+    Writes all.svg, full.svg, cumm.svg and diff.svg.
+'''
+
+#############################################################################
+
+def load_jobs(files, start_date, end_date):
+    ''' Parse the dump the way runme's bpdbreport.py run does
+    (--show_backups, done jobs between start_date and end_date) and return
+    the done jobs by jobid.'''
+    bpdbreport.debug_mode = False
+    bpdbreport.verbose = False
+    bpdbreport.show_backups = True
+    bpdbreport.start_date = start_date
+    bpdbreport.end_date = end_date
+    bpdbreport.projection(chart_columns + ( 'trystarted', 'tryended' ))
+    done_master = {}
+    masters = ( {}, {}, {}, done_master )
+    prefilter = bpdbreport.Prefilter(start_date, end_date, True, ( '3', ))
+    bpdbreport.parse_input(bpdbreport.StreamReader(files, prefilter), masters)
+    return done_master
+
+def chart_views(done_master, cleanup):
+    ''' One pass over the done jobs, in bpdbreport.py's output order.
+    Returns { chart name : rows }, where a row is
+    (client, class, sched, trystarted, tryended) with the cleanup applied.
+    The views share the row tuples.'''
+    rows = dict([ (name, []) for name, match in views ])
+    keys = done_master.keys()
+    keys.sort()
+    for key in keys:
+        job = done_master[key]
+        names = tuple([ cleanup(str(getattr(job, column))) for column in chart_columns ])
+        wanted = [ rows[name] for name, match in views
+                   if not match or match in ','.join(names) ]
+        for idx in bpdbreport.try_order(len(job.tries)):
+            job_try = job.tries[idx]
+            row = names + ( job_try.trystarted, job_try.tryended )
+            for view in wanted:
+                view.append(row)
+    return rows
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+#############################################################################
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:e:o:r:h", ["stats", "packed", "flat", "budget="])
+    except getopt.GetoptError, msg:
+        print "Usage Error:", repr(msg)
+        usage()
+        sys.exit(2)
+
+    today = time.mktime(time.strptime(time.strftime('%d/%b/%Y'), '%d/%b/%Y'))
+    start_date = today - 86400
+    end_date = time.mktime(time.localtime())
+    out_dir = ''
+    rules = default_rules
+    show_stats = False
+    packed = False
+    budget = None
+    style = 'gradient'
+    for o, a in opts:
+        if o == "-h":
+            usage()
+            sys.exit()
+        if o == "--stats":
+            show_stats = True
+        if o == "--packed":
+            packed = True
+        if o == "--flat":
+            style = 'flat'
+        if o == "--budget":
+            try:
+                budget = int(a)
+            except ValueError:
+                print >>sys.stderr, '\n--budget needs a number of pixels'
+                usage()
+                sys.exit(1)
+        if o == "-o":
+            out_dir = a
+        if o == "-r":
+            rules = a
+        if o in ("-s", "-e"):
+            try:
+                date = time.mktime(time.strptime(a, '%d/%b/%Y'))
+            except:
+                print >>sys.stderr, '\nDate values must be in dd/mmm/yyyy format'
+                usage()
+                sys.exit(1)
+            if o == "-s":
+                start_date = date
+            else:
+                end_date = date + 86399   # Add 23:59:59 to enddate to include that day
+
+    if not args:
+        args = [ 'bpdbjobs.out' ]
+    for arg in args:
+        if arg != '-' and not os.path.exists(arg):
+            print >>sys.stderr, '\nFile', arg, 'does not exist.'
+            usage()
+            sys.exit(1)
+
+    try:
+        cleanup = rewrite.load(rules)
+    except (IOError, rewrite.RuleError), msg:
+        print >>sys.stderr, '\nCan not read rules:', msg
+        sys.exit(1)
+
+    began = time.time()
+    done_master = load_jobs(args, start_date, end_date)
+    rows = chart_views(done_master, cleanup)
+    for name, match in views:
+        if not rows[name]:
+            print >>sys.stderr, 'No rows for', name + '.svg', '- not written'
+            continue
+        produce_gantt.render_chart(os.path.join(out_dir, name), rows[name],
+                                   packed, budget, style)
+    if show_stats:
+        print >>sys.stderr, 'STATS:    jobs charted:        ', len(done_master)
+        print >>sys.stderr, 'STATS:    rows charted:        ', len(rows['all'])
+        print >>sys.stderr, 'STATS:    wall time:            %.2fs' % (time.time() - began)
+        print >>sys.stderr, 'STATS:    peak RSS:             %dkB' % peak_rss()
+
+# modeline vim:set ts=4 sw=4 et:
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+"""
+How many tries were running at each moment, overall and per storage unit
+or media server.  Reads the rows concurrency.fmt makes bpdbreport.py
+write (trystunit,tryserver,trystarted,tryended):
+
+    bpdbreport.py -f concurrency.fmt --no_header -s 13/Oct/2012 bpdbjobs.out \\
+        | produce_concurrency.py --by stunit
+
+draws concurrency.svg with CairoPlot's dot_line_plot and prints the peak
+of every series.  --csv prints the step series instead of drawing it.
+"""
+
+import getopt
+import sys
+import time
+
+import produce_gantt
+
+# columns of an input row
+group_columns = { 'stunit' : 0, 'server' : 1 }
+# series key of the overall timeline: no stunit or server name can be
+# None, so a group of any name can not overwrite it
+OVERALL = None
+STARTED = 2
+ENDED = 3
+
+def USAGE() :
+    print >>sys.stderr, """
+produce_concurrency.py usage:
+
+    produce_concurrency.py [switches] [file]
+
+    --by stunit|server       a series per storage unit or media server
+                               as well as the overall one
+    --csv                    print group,time,concurrent rows for every
+                               change instead of drawing concurrency.svg
+    -o name                  draw name.svg (default: concurrency)
+    -h                       print this help and exit
+"""
+
+def sweep(starts, ends) :
+    """
+    Step function of how many intervals are open, as a list of
+    (time, count) at every time the count changes.  starts and ends are
+    the two halves of the intervals.  An interval counts from its start up
+    to, not including, its end, so a try that starts the second another
+    ends does not overlap it.
+    """
+    delta = {}
+    get = delta.get
+    for start in starts :
+        delta[start] = get(start, 0) + 1
+    for end in ends :
+        delta[end] = get(end, 0) - 1
+    steps = []
+    running = 0
+    for when in sorted(delta) :
+        change = delta[when]
+        if change :
+            running += change
+            steps.append((when, running))
+    return steps
+
+def peak(steps) :
+    """
+    (count, when, seconds) of the highest step: the first time it was
+    reached and how long it held.  when is None if there are no steps,
+    i.e. no try of any length.
+    """
+    best = (0, None, 0)
+    for idx, (when, count) in enumerate(steps) :
+        if count > best[0] :
+            if idx + 1 < len(steps) :
+                held = steps[idx + 1][0] - when
+            else :
+                held = 0
+            best = (count, when, held)
+    return best
+
+def timelines(rows, by=None) :
+    """
+    { series name : steps } for the overall series (under OVERALL) and,
+    with by, one series per storage unit or media server.  A row without
+    both times, a try still queued or running, is reported and skipped.
+    """
+    starts = []
+    ends = []
+    groups = {}
+    column = group_columns.get(by)
+    for line in rows :
+        try :
+            start = int(line[STARTED])
+            end = int(line[ENDED])
+        except ValueError :
+            print >>sys.stderr, 'ERROR: ', ','.join(line)
+            continue
+        if end < start :
+            continue
+        starts.append(start)
+        ends.append(end)
+        if column is not None :
+            group = groups.get(line[column])
+            if group is None :
+                group = groups[line[column]] = ([], [])
+            group[0].append(start)
+            group[1].append(end)
+    series = {}
+    if starts :
+        series[OVERALL] = sweep(starts, ends)
+    for name, (group_starts, group_ends) in groups.iteritems() :
+        series[name] = sweep(group_starts, group_ends)
+    return series
+
+def sampled(steps, first, last, buckets) :
+    """
+    The step function cut into buckets equal slices of first..last, each
+    given the highest count seen in it, for dot_line_plot.
+    """
+    width = max(float(last - first) / buckets, 1.0)
+    values = [ 0 ] * buckets
+    count = 0
+    idx = 0
+    for bucket in range(buckets) :
+        top = first + (bucket + 1) * width
+        high = count
+        while idx < len(steps) and steps[idx][0] < top :
+            count = steps[idx][1]
+            high = max(high, count)
+            idx += 1
+        values[bucket] = high
+    return values
+
+def stamp(seconds) :
+    return time.strftime('%d/%b/%Y %H:%M:%S', time.localtime(seconds))
+
+def hms(seconds) :
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+def series_name(group) :
+    if group is OVERALL :
+        return '(all)'
+    return group
+
+def render(name, series) :
+    """
+    Draw the series into name.svg.  Returns False, and draws nothing, if
+    no series has a step to draw.
+    """
+    drawn = [ steps for steps in series.values() if steps ]
+    if not drawn :
+        return False
+    import CairoPlot
+    h_pixals = 1360
+    v_pixals = 600
+    first = min([ steps[0][0] for steps in drawn ])
+    last = max([ steps[-1][0] for steps in drawn ])
+    buckets = h_pixals // 4
+    data = dict([ (series_name(group), sampled(steps, first, last, buckets))
+                  for group, steps in series.iteritems() ])
+    CairoPlot.dot_line_plot(name, data, h_pixals, v_pixals, axis=True,
+                            grid=True, h_labels=produce_gantt.calc_vticks(first, last))
+    return True
+
+def main() :
+    try :
+        opts, args = getopt.getopt(sys.argv[1:], "o:h", ["by=", "csv"])
+    except getopt.GetoptError, msg :
+        print >>sys.stderr, "Usage Error:", repr(msg)
+        USAGE()
+        sys.exit(2)
+    by = None
+    as_csv = False
+    name = 'concurrency'
+    for o, a in opts :
+        if o == "-h" :
+            USAGE()
+            sys.exit()
+        if o == "--by" :
+            if a not in group_columns :
+                USAGE()
+                sys.exit(1)
+            by = a
+        if o == "--csv" :
+            as_csv = True
+        if o == "-o" :
+            name = a
+    if args :
+        f = open(args[0])
+    else :
+        f = sys.stdin
+
+    series = timelines(produce_gantt.chart_rows(f, 4), by)
+    if not [ steps for steps in series.values() if steps ] :
+        # no rows, or only tries that ended as they started
+        print >>sys.stderr, 'no tries to chart'
+        sys.exit(1)
+
+    if as_csv :
+        out = []
+        for group in sorted(series) :
+            for when, count in series[group] :
+                out.append('%s,%d,%d' % (series_name(group), when, count))
+        out.append('')
+        sys.stdout.write('\n'.join(out))
+        report = sys.stderr
+    else :
+        render(name, series)
+        report = sys.stdout
+    for group in sorted(series) :
+        count, when, held = peak(series[group])
+        if when is None :
+            print >>report, '%s: no tries' % series_name(group)
+        else :
+            print >>report, '%s: peak %d at %s for %s' % (series_name(group), count, stamp(when), hms(held))
+
+if __name__ == '__main__' :
+    main()
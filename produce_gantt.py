@@ -1,27 +1,13 @@
 #!/usr/bin/python
 
 import csv
+import mmap
 import os.path
+import stat
 import sys
 import time
 
-import CairoPlot
-
-def scaled_times(times, first) :
-    """
-    Scale times of each job's tries in the form of 
-         [(start,end), (start,end) ...]
-    to the time of the first job starting.  Translates from reality to 
-    CairoPlot relative reality.
-    """
-    results = []
-    for start, end in times :
-        delta_0_start = float(start - first)
-        delta_0_end = float(end - first)
-        # now append the deltas, scaled to hours (hence the 3600) the .0
-        # re-enforces the idea that these must be floating point
-        results.append( ((delta_0_start / 3600.0), (delta_0_end / 3600.0)))
-    return results
+import bpdbcolumns
 
 def calc_vticks(first, last) :
     """
@@ -35,18 +21,195 @@ def calc_vticks(first, last) :
     delta_hours = ((last - first) // 3600)
     return [ str((h + first_hour) % 24) for h in range(delta_hours + 1) ]
 
+def USAGE() :
+    print >>sys.stderr, """
+produce_gantt.py usage:
+
+    produce_gantt.py [--packed] [--flat] [--budget pixels] [file]
+
+    file is client,class,sched,trystarted,tryended csv rows (bpdbreport.py
+    -f sample.fmt) or a bpdbreport.py --columns file.  Reads stdin if no
+    file is given and draws visual_schedule.svg.
+
+    --packed                 let jobs that do not overlap share a row
+    --flat                   draw plain solid bars instead of rounded,
+                               shadowed ones: a much smaller SVG
+    --budget pixels          keep the image at most this many pixels high:
+                               rows get thinner as there are more of them,
+                               bars are drawn with less detail and, past
+                               4 pixel rows, several jobs share a row
+"""
+
 def parse_commandline() :
-    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]) :
-        f = open(sys.argv[1])
-    elif len(sys.argv) > 1 :
+    # --packed, --flat and --budget may come before or after the file name
+    args = sys.argv[1:]
+    packed = '--packed' in args
+    style = 'gradient'
+    if '--flat' in args :
+        style = 'flat'
+    args = [ arg for arg in args if arg not in ('--packed', '--flat') ]
+    budget = None
+    if '--budget' in args :
+        idx = args.index('--budget')
+        try :
+            budget = int(args[idx + 1])
+        except (IndexError, ValueError) :
+            USAGE()
+            sys.exit(1)
+        del args[idx:idx + 2]
+    if len(args) > 0 and os.path.isfile(args[0]) :
+        f = open(args[0])
+    elif len(args) > 0 :
         USAGE()
         sys.exit(1)
     else :
         f = sys.stdin
-    return f
+    return f, packed, budget, style
 
 
-def main() :
+def input_lines(f) :
+    """
+    Lines of the input file.  A regular file is memory-mapped and cut up
+    in place rather than going through Python's line iteration, so the
+    same intermediate file can be read by several runs out of the shared
+    page cache.  Anything else (stdin, pipes) is read line by line.
+    """
+    info = os.fstat(f.fileno())
+    if not stat.S_ISREG(info.st_mode) or info.st_size == 0 :
+        for inputline in f :
+            yield inputline
+        return
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    find = m.find
+    pos = 0
+    size = info.st_size
+    while pos < size :
+        end = find('\n', pos) + 1
+        if end == 0 :
+            end = size
+        yield m[pos:end]
+        pos = end
+    m.close()
+
+def chart_rows(f, fields=5) :
+    """
+    client,class,sched,trystarted,tryended rows of an intermediate file
+    (or any rows of that many fields).  Each line is parsed on its own, so
+    an unbalanced quote cannot swallow the lines after it; a line that
+    does not come out as that many fields is reported and skipped.
+    """
+    for inputline in input_lines(f) :
+        try :
+            line = csv.reader([inputline], escapechar='\\').next()
+        except (csv.Error, StopIteration) :
+            line = None
+        if line == [] :
+            continue
+        if line is None or len(line) != fields :
+            print >>sys.stderr, 'ERROR: ', inputline.rstrip('\n')
+            continue
+        yield line
+
+def gantt_inputs(rows) :
+    """
+    Work out what gantt_chart needs from client,class,sched,trystarted,
+    tryended rows: returns (pieces, tasknames, v_tickmarks, colors, v_pixals).
+    Rows only need to be indexable, so this takes csv rows as well as the
+    in-memory rows make_charts.py hands over.  A bpdbcolumns.Columns is
+    taken as it is: its times are already ints and its rows are told
+    apart by their client/class/sched codes, so a name is only joined
+    once per job.
+    """
+    if isinstance(rows, bpdbcolumns.Columns) :
+        clients, classes, scheds = rows.names
+        label = lambda key : "__".join((clients[key[0]], classes[key[1]], scheds[key[2]]))
+        return gantt_model(zip(*rows.codes), rows.starts, rows.ends, label)
+    keys = []
+    allstarts = []
+    allends = []
+    for line in rows:
+        keys.append("__".join(line[0:3]))
+        allstarts.append(int(line[3]))
+        allends.append(int(line[4]))
+    return gantt_model(keys, allstarts, allends)
+
+def gantt_model(keys, allstarts, allends, label=str) :
+    """
+    gantt_inputs for rows already split into columns: a key telling the
+    jobs apart, the start and the end of each row.  label(key) is the task
+    name.  Every job is one row of the chart, holding all of its tries,
+    and the rows are in the order of each job's first start.
+    """
+    bar_color = (1.0, 0.7, 0.0)
+    # job index of every row
+    index = {}
+    get = index.get
+    jobs = []
+    for key in keys :
+        job = get(key)
+        if job is None :
+            job = index[key] = len(index)
+        jobs.append(job)
+
+    first = min(allstarts)
+    last = max(allends)
+    v_tickmarks = calc_vticks(first, last)
+    # 350 vertical pixals.  70 for each task + 70 for headers.
+    v_pixals = (len(index) + 1) * 70
+    # offsets from the first start, scaled to hours (hence the 3600) the .0
+    # re-enforces the idea that these must be floating point
+    scaled_starts = [ (start - first) / 3600.0 for start in allstarts ]
+    scaled_ends = [ (end - first) / 3600.0 for end in allends ]
+
+    bars = [ [] for job in index ]
+    firsts = [ last ] * len(index)
+    for job, start, piece in zip(jobs, allstarts, zip(scaled_starts, scaled_ends)) :
+        bars[job].append(piece)
+        if start < firsts[job] :
+            firsts[job] = start
+
+    keys_by_job = [ None ] * len(index)
+    for key, job in index.iteritems() :
+        keys_by_job[job] = key
+    # sorted() is stable: jobs that start together keep their input order
+    order = sorted(range(len(index)), key=firsts.__getitem__)
+    tasknames = [ label(keys_by_job[job]) for job in order ]
+    pieces = [ bars[job] for job in order ]
+    colors = [ bar_color ] * len(order)
+    return pieces, tasknames, v_tickmarks, colors, v_pixals
+
+def packed_lanes(pieces, tasknames, h_pixals, v_tickmarks) :
+    """
+    Number of lanes of a packed chart, counted the way GanttChart packs
+    them, with the room for labels that do not fit on their bar estimated
+    from the name length.
+    """
+    import CairoPlot
+    step = float(h_pixals - 20) / len(v_tickmarks)
+    char = 0.6 * 0.009 * h_pixals
+    spans = []
+    for item, name in zip(pieces, tasknames) :
+        start, end = CairoPlot.task_span(item)
+        width = len(name) * char + 8
+        if width > (end - start) * step :
+            end += width / step
+        spans.append((start, end))
+    return CairoPlot.pack_lanes(spans)[1]
+
+def render_chart(name, rows, packed=False, budget=None, style='gradient') :
+    """
+    Draw the gantt chart for rows into name.svg.  packed lets jobs that do
+    not overlap share a row, which makes for a far smaller image when
+    there are many short jobs.  With a budget the image is kept at most
+    that many pixals high (see CairoPlot.gantt_size) and drawn at the
+    level of detail that leaves, so days or weeks of jobs still make a
+    chart of bounded size.  style 'flat' draws plain solid bars, which
+    keeps the SVG to a rectangle per try instead of a dozen gradient
+    fills.
+    """
+    # CairoPlot (and cairo) only when drawing, so reading rows does not
+    # need them; produce_concurrency.py --csv uses chart_rows alone
+    import CairoPlot
     #h_pixals = 1600
     h_pixals = 1360
     # 500 horizontal pixals: 120 for names, 380 for bars.
@@ -55,47 +218,36 @@ def main() :
     #          120 * 6 = 720
     #     960 + 640 = 1600 horizontal pixals.
     h_legend = []
-    allstarts = []
-    allends = []
-    colors = []
-    tasknames = []
-    pieces = []
-    bars = {}
-    starttimes = {}
-    bar_color = (1.0, 0.7, 0.0)
-
-    f = parse_commandline()
-
-    for inputline in f :
-        for line in csv.reader([inputline], escapechar='\\'):
-            name = "__".join(line[0:3])
-            start = int(line[3])
-            end = int(line[4])
-            #if time.gmtime(end)[3:5] == (6,13) :
-            #    print name
-            bars.setdefault(name, []).append((start,end))
-            allstarts.append(start)
-            allends.append(end)
-            starttimes.setdefault(start, []).append(name)
+    pieces, tasknames, v_tickmarks, colors, v_pixals = gantt_inputs(rows)
+    rows = len(pieces)
+    if packed :
+        rows = packed_lanes(pieces, tasknames, h_pixals, v_tickmarks)
+        # 70 pixals per lane + 70 for headers
+        v_pixals = (rows + 1) * 70
+    if budget :
+        h_pixals, v_pixals = CairoPlot.gantt_size(rows, h_pixals, budget)
+        CairoPlot.gantt_chart(name, pieces, h_pixals, v_pixals,
+                              tasknames, v_tickmarks, colors, packed, lod=True, style=style)
+    elif style != 'gradient' :
+        CairoPlot.gantt_chart(name, pieces, h_pixals, v_pixals,
+                              tasknames, v_tickmarks, colors, packed, style=style)
+    elif packed :
+        CairoPlot.gantt_chart(name, pieces, h_pixals, v_pixals,
+                              tasknames, v_tickmarks, colors, packed)
+    else :
+        CairoPlot.gantt_chart(name, pieces, h_pixals, v_pixals,
+                              tasknames, v_tickmarks, colors)
 
-    first = min(allstarts)
-    last = max(allends)
-    v_tickmarks = calc_vticks(first, last)
-    v_pixals = (len(bars.keys()) + 1) * 70
-    # 350 vertical pixals.  70 for each task + 70 for headers.
-    # v_tickmarks = scale_vlines(first, last)
-    for start in sorted(starttimes.keys()) :
-        for name in starttimes[start] :
-            # one task name.
-            tasknames.append(name)
-            # need 1 color per name
-            colors.append(bar_color)
-            times = bars[name]
-            #print 'debug', name
-            pieces.append(scaled_times(times, first))
-
-    CairoPlot.gantt_chart('visual_schedule', pieces, h_pixals, v_pixals, 
-                          tasknames, v_tickmarks, colors)
+def main() :
+    f, packed, budget, style = parse_commandline()
+    # stdin may be a pipe, which can not be peeked at and seeked back
+    f = bpdbcolumns.seekable(f)
+    if bpdbcolumns.is_columns(f) :
+        # bpdbreport.py --columns: the columns come straight off the map
+        rows = bpdbcolumns.Columns(f)
+    else :
+        rows = chart_rows(f)
+    render_chart('visual_schedule', rows, packed, budget, style)
 
 if __name__ == '__main__' :
     main()
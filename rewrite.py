@@ -0,0 +1,142 @@
+#!/usr/bin/python
+#
+# rewrite.py
+#
+# Label rewriting (the cleanup.sh substitutions) done in process.
+#
+# Rules come from a sed script of s commands, the same file cleanup.sh
+# hands to sed -f:
+#
+#   # comment
+#   s/.atl.weather.com//g
+#   s/erential//g
+#
+# Patterns are taken as Python regular expressions, which agrees with
+# sed for the plain text and '.' the shipped rules use.  In the
+# replacement '&' is the whole match and \1..\9 are groups, as in sed.
+# 'g' replaces every match, otherwise only the first.
+#
+# All the patterns are also compiled into one alternation, so a string
+# none of them match is passed back after a single search.  Strings that
+# do match go through the rules one after the other, like sed, since an
+# earlier rule can make or break a match for a later one.  Either way the
+# answer is kept, so each distinct string is only rewritten once.
+
+import re
+import sys
+
+#############################################################################
+
+class RuleError(Exception):
+    pass
+
+def split_command( line ):
+    ''' s/pattern/replacement/flags -> (pattern, replacement, flags)'''
+    if len(line) < 2 or line[0] != 's':
+        raise RuleError('only s commands are supported: %s' % line)
+    delim = line[1]
+    parts = []
+    current = ''
+    idx = 2
+    while idx < len(line):
+        char = line[idx]
+        if char == '\\' and idx + 1 < len(line):
+            if line[idx+1] == delim:
+                current += delim
+            else:
+                current += line[idx:idx+2]
+            idx += 2
+            continue
+        if char == delim and len(parts) < 2:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+        idx += 1
+    if len(parts) != 2:
+        raise RuleError('unterminated s command: %s' % line)
+    return parts[0], parts[1], current
+
+def sed_replacement( text ):
+    ''' sed's & and \\n in a replacement, spelled the way re.sub wants.'''
+    out = ''
+    idx = 0
+    while idx < len(text):
+        char = text[idx]
+        if char == '\\' and idx + 1 < len(text):
+            out += text[idx:idx+2]
+            idx += 2
+            continue
+        if char == '&':
+            out += '\\g<0>'
+        else:
+            out += char
+        idx += 1
+    return out
+
+def read_rules( path ):
+    ''' [(pattern, replacement, count)] from a sed script of s commands.'''
+    rules = []
+    for lineno, line in enumerate(open(path)):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            pattern, replacement, flags = split_command(line)
+        except RuleError, msg:
+            raise RuleError('%s line %d: %s' % (path, lineno + 1, msg))
+        if 'g' in flags:
+            count = 0
+        else:
+            count = 1
+        rules.append(( pattern, sed_replacement(replacement), count ))
+    return rules
+
+#############################################################################
+
+class Rewriter(object):
+    ''' Applies a list of (pattern, replacement, count) rules to strings,
+    remembering the result for every string it has seen.'''
+    def __init__(self, rules):
+        self.rules = [ ( re.compile(pattern), replacement, count )
+                       for pattern, replacement, count in rules ]
+        if rules:
+            self.matcher = re.compile('|'.join([ '(?:%s)' % pattern
+                                                 for pattern, replacement, count in rules ]))
+        else:
+            self.matcher = None
+        self.seen = {}
+
+    def rewrite(self, text):
+        if self.matcher is None or not self.matcher.search(text):
+            return text
+        for rule, replacement, count in self.rules:
+            text = rule.sub(replacement, text, count)
+        return text
+
+    def __call__(self, text):
+        try:
+            return self.seen[text]
+        except KeyError:
+            result = self.seen[text] = self.rewrite(text)
+            return result
+
+def load( path ):
+    return Rewriter(read_rules(path))
+
+#############################################################################
+
+if __name__ == '__main__':
+    # rewrite.py rules.sed [file]: what sed -f rules.sed [file] prints
+    if len(sys.argv) < 2:
+        print >>sys.stderr, 'usage: rewrite.py rules.sed [file]'
+        sys.exit(1)
+    rewriter = load(sys.argv[1])
+    if len(sys.argv) > 2:
+        f = open(sys.argv[2])
+    else:
+        f = sys.stdin
+    for line in f:
+        sys.stdout.write(rewriter(line))
+
+# modeline vim:set ts=4 sw=4 et:
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+#
+# test_bpdbreport.py
+#
+# Checks for the bpdbreport.py input paths.  Run with
+#
+#   python -m unittest discover
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+import distutils.spawn
+
+import gendump
+import rewrite
+import bpdbreport
+import bpdbcolumns
+import produce_gantt
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+class StreamReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def dump(self, data):
+        path = os.path.join(self.workdir, 'bpdbjobs.out')
+        fp = open(path, 'wb')
+        fp.write(data)
+        fp.close()
+        return path
+
+    def records(self, reader_class, data):
+        return list(reader_class([ self.dump(data) ]))
+
+    def test_escaped_newline(self):
+        for reader_class in ( bpdbreport.StreamReader, bpdbreport.MmapReader ):
+            self.assertEqual(self.records(reader_class, '1,a\\\nb\n2,c\n'),
+                             [ [ '1', 'a\nb' ], [ '2', 'c' ] ])
+
+    def test_trailing_escape(self):
+        # the last record ends in a lone backslash and no newline
+        for reader_class in ( bpdbreport.StreamReader, bpdbreport.MmapReader ):
+            self.assertEqual(self.records(reader_class, '1,a\n2,b\\'),
+                             [ [ '1', 'a' ], [ '2', 'b\n' ] ])
+
+class ParseChunkTest(unittest.TestCase):
+    ''' parse_chunk in this process, as a --jobs worker handed two chunks
+    in a row runs it.'''
+    options = { 'show_backups' : False, 'start_date' : 0, 'end_date' : 2**40,
+                'debug_mode' : False, 'mmap_mode' : False, 'profile' : None }
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        for name, value in self.options.iteritems():
+            setattr(bpdbreport, name, value)
+        bpdbreport.prefilter = bpdbreport.Prefilter(0, 2**40, False, bpdbreport.Prefilter.all_states)
+        bpdbreport.prefilter.incremental(-1, {})
+
+    def tearDown(self):
+        for name in self.options.keys() + [ 'prefilter' ]:
+            delattr(bpdbreport, name)
+        shutil.rmtree(self.workdir)
+
+    def chunk(self, jobs, seed):
+        path = os.path.join(self.workdir, 'bpdbjobs.%d.out' % seed)
+        fp = open(path, 'wb')
+        gendump.Generator(jobs=jobs, seed=seed).write(fp)
+        fp.close()
+        return ( path, 0, os.path.getsize(path) )
+
+    def test_seen_is_per_chunk(self):
+        first = self.chunk(300, 1)
+        second = self.chunk(200, 2)
+        alone = dict(bpdbreport.parse_chunk(second)[4])
+        bpdbreport.parse_chunk(first)
+        self.assertEqual(bpdbreport.parse_chunk(second)[4], alone)
+
+class ParallelOutputTest(unittest.TestCase):
+    ''' --jobs output against the serial --stream output, on a dump where
+    every cut split_input starts from falls inside a record that goes on
+    past an escaped newline.'''
+    columns = ( 'jobid', 'state', 'client', 'path_last_written',
+                'trystarted', 'trystatusdescription' )
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'bpdbjobs.out')
+        fp = open(self.path, 'wb')
+        gendump.Generator(jobs=3200, escapes=50, seed=2).write(fp)
+        fp.close()
+        self.fmt = os.path.join(self.workdir, 'test.fmt')
+        fp = open(self.fmt, 'w')
+        fp.write('\n'.join(self.columns) + '\n')
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def continued(self, data, offset):
+        ''' Whether offset is inside a record split by an escaped newline.'''
+        def escaped(idx):
+            slashes = 0
+            while idx - slashes > 0 and data[idx-slashes-1] == '\\':
+                slashes += 1
+            return idx >= 0 and slashes % 2 == 1
+        return escaped(data.find('\n', offset)) or escaped(data.rfind('\n', 0, offset))
+
+    def report(self, *args):
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.check_output([ sys.executable, os.path.join(here, 'bpdbreport.py'),
+                                             '--show_all', '-f', self.fmt ] + list(args) + [ self.path ],
+                                           stderr=devnull)
+        finally:
+            devnull.close()
+
+    def test_cuts_inside_records(self):
+        # the cuts split_input starts from: a chunk per MB, at most jobs
+        data = open(self.path, 'rb').read()
+        for jobs in ( 2, 3 ):
+            count = min(jobs, len(data) // 1048576)
+            self.assertEqual(count, jobs)
+            for i in range(1, count):
+                self.assertTrue(self.continued(data, len(data) * i // count))
+
+    def test_parallel_matches_serial(self):
+        serial = self.report('--stream')
+        self.assertTrue(serial.count('\n') > 3200)
+        for jobs in ( '2', '3' ):
+            self.assertEqual(self.report('--jobs', jobs), serial)
+
+sed = distutils.spawn.find_executable('sed')
+
+@unittest.skipUnless(sed, 'needs sed to compare with')
+class RewriteTest(unittest.TestCase):
+    ''' --rewrite cleanup.sed against what cleanup.sh made of the csv with
+    sed -f cleanup.sed.'''
+    rules = os.path.join(here, 'cleanup.sed')
+    # every rule, the '.'s the rules leave unescaped, and rules that make
+    # or break a match for a later one
+    labels = [ 'db1.atl.weather.com', 'web2.corp.weather.com', 'x.itdev.weather.com',
+               'ittech.weather.com', 'a.be.weather.com', 'fw.dmz.weather.com',
+               'hostXatlYweatherZcom', 'Differential', 'Cumulative', '01mo-Full',
+               '03-m0-Daily', 'pol_windows', 'dowsdows', 'erentialulative',
+               'Differulative', '01mo-01mo-x', 'host7.example.com', '' ]
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def sed(self, text):
+        child = subprocess.Popen([ sed, '-f', self.rules ], stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE)
+        return child.communicate(text)[0]
+
+    def test_labels_match_sed(self):
+        rewriter = rewrite.load(self.rules)
+        expected = self.sed(''.join([ label + '\n' for label in self.labels ])).split('\n')
+        self.assertEqual([ rewriter(label) for label in self.labels ], expected[:-1])
+
+    def test_report_matches_sed(self):
+        path = os.path.join(self.workdir, 'bpdbjobs.out')
+        fp = open(path, 'wb')
+        gendump.Generator(jobs=1000, seed=3).write(fp)
+        fp.close()
+        report = [ sys.executable, os.path.join(here, 'bpdbreport.py'), '--stream',
+                   '-f', os.path.join(here, 'sample.fmt'), '--no_header', '--show_backups' ]
+        plain = subprocess.check_output(report + [ path ])
+        rewritten = subprocess.check_output(report + [ '--rewrite', self.rules, path ])
+        self.assertNotEqual(plain, rewritten)
+        self.assertEqual(rewritten, self.sed(plain))
+
+class ColumnsTest(unittest.TestCase):
+    ''' A --columns file against the -f sample.fmt csv of the same run, as
+    produce_gantt.py reads either.'''
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'bpdbjobs.out')
+        fp = open(self.path, 'wb')
+        gendump.Generator(jobs=1000, seed=3).write(fp)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def outputs(self, *args):
+        ''' (csv rows, Columns) of one bpdbreport.py run with args.'''
+        report = [ sys.executable, os.path.join(here, 'bpdbreport.py'), '--stream',
+                   '--show_backups' ] + list(args)
+        csv_path = os.path.join(self.workdir, 'stage1.out')
+        columns_path = os.path.join(self.workdir, 'stage1.col')
+        fp = open(csv_path, 'wb')
+        subprocess.check_call(report + [ '-f', os.path.join(here, 'sample.fmt'),
+                                         '--no_header', self.path ], stdout=fp)
+        fp.close()
+        subprocess.check_call(report + [ '--columns', columns_path, self.path ])
+        rows = list(produce_gantt.chart_rows(open(csv_path)))
+        return rows, bpdbcolumns.Columns(open(columns_path, 'rb'))
+
+    def test_round_trip(self):
+        for args in ( [], [ '--rewrite', os.path.join(here, 'cleanup.sed') ] ):
+            rows, columns = self.outputs(*args)
+            self.assertTrue(rows)
+            self.assertEqual(list(columns),
+                             [ ( c, k, s, int(started), int(ended) ) for c, k, s, started, ended in rows ])
+            self.assertEqual(produce_gantt.gantt_inputs(columns), produce_gantt.gantt_inputs(rows))
+
+class StateFileTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        # two dumps of the same jobids, the second taken later with some
+        # jobs in another state, each big enough for --jobs to split
+        self.dumps = []
+        for seed in ( 1, 2 ):
+            path = os.path.join(self.workdir, 'bpdbjobs.%d.out' % seed)
+            fp = open(path, 'wb')
+            gendump.Generator(jobs=2500, seed=seed).write(fp)
+            fp.close()
+            self.dumps.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def state(self, name, *args):
+        path = os.path.join(self.workdir, name)
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call([ sys.executable, os.path.join(here, 'bpdbreport.py'),
+                                    '--state_file', path, '-q' ] + list(args) + self.dumps,
+                                  stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+        return json.load(open(path))
+
+    def test_parallel_matches_serial(self):
+        serial = self.state('serial.json', '--stream')
+        parallel = self.state('parallel.json', '--jobs', '2')
+        self.assertEqual(serial['hwm'], parallel['hwm'])
+        self.assertEqual(serial['flux'], parallel['flux'])
+
+    def test_done_jobs_leave_flux(self):
+        # one day's jobs are reported, the Done ones of the other days
+        # below the high-water mark must not be kept in flux
+        state = self.state('serial.json', '--stream', '--show_active',
+                           '-s', '03/Oct/2012', '-e', '03/Oct/2012')
+        self.assertTrue(state['flux'])
+        self.assertFalse([ s for s in state['flux'].values() if s == '3' ])
+
+if __name__ == '__main__':
+    unittest.main()